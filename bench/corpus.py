@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A deterministic generator of markdown documents for benchmarks.
+
+Documents are made from a seeded random generator, so the same parameters
+always make the same text.  The parameters are the document's size in
+bytes, its number of fenced blocks and their languages, and how many of the
+words in its prose are inline code or naked urls.  ``scenarios`` names the
+mixes the benchmark suite uses.
+
+To write a tree of documents to look at or to build by hand:
+
+    $ python bench/corpus.py <directory> [scenario] [documents]
+"""
+
+import os
+import sys
+import random
+
+words = (u"the of and to in is that for it as with was on be by this are "
+    u"document render markdown code block table page heading list link image "
+    u"value option build cache output source template asset style theme "
+    u"install configure server client request response error message "
+    u"naïve café résumé").split()
+
+snippets = {
+    "python": [u"def {0}({1}):", u"    return {1} + {2}", u"import {0}",
+        u"class {0}(object):", u"    {1} = [x for x in {2} if x]", u"# {0} {1}"],
+    "javascript": [u"function {0}({1}) {{", u"  return {1} + {2};", u"}}",
+        u"var {0} = require('{1}');", u"{0}.forEach(function(x) {{ {1}(x); }});"],
+    "go": [u"func {0}({1} int) int {{", u"\treturn {1} + {2}", u"}}",
+        u"import \"{0}\"", u"{0} := make([]string, {1})"],
+    "sql": [u"SELECT {0}, {1} FROM {2}", u"WHERE {0} = '{1}'", u"ORDER BY {2};"],
+    "bash": [u"for f in *.{0}; do", u"  {1} \"$f\" > {2}.out", u"done"],
+    None: [u"{0} {1} {2}", u"  {1}_{2} = {0}"],
+}
+
+default_languages = ("python", "javascript", "go", "sql", "bash", None)
+
+# name: generator parameters
+scenarios = {
+    "prose": dict(size=16*1024, fences=0, inline_code=0.01, urls=0.005),
+    "mixed": dict(size=32*1024, fences=8, inline_code=0.05, urls=0.02),
+    "code": dict(size=32*1024, fences=40, inline_code=0.15, urls=0.01),
+    "urls": dict(size=16*1024, fences=2, inline_code=0.02, urls=0.2),
+    "large": dict(size=512*1024, fences=120, inline_code=0.05, urls=0.02),
+}
+
+def identifier(rng):
+    return u"_".join(rng.choice(words[:40]) for i in range(rng.randint(1, 3)))
+
+def prose_word(rng, inline_code, urls):
+    roll = rng.random()
+    if roll < inline_code:
+        return u"`%s()`" % identifier(rng)
+    if roll < inline_code + urls:
+        return u"http://example.com/%s/%d" % (identifier(rng), rng.randint(1, 999))
+    if roll < inline_code + urls + 0.02:
+        return identifier(rng)
+    return rng.choice(words)
+
+def paragraph(rng, inline_code, urls):
+    lines = []
+    for i in range(rng.randint(1, 5)):
+        line = u" ".join(prose_word(rng, inline_code, urls) for j in range(rng.randint(6, 16)))
+        lines.append(line[0].upper() + line[1:] + u".")
+    return u"\n".join(lines)
+
+def fence(rng, language):
+    lines = [u"```%s" % (language or u"")]
+    for i in range(rng.randint(3, 25)):
+        template = rng.choice(snippets[language])
+        lines.append(template.format(identifier(rng), identifier(rng), identifier(rng)))
+    lines.append(u"```")
+    return u"\n".join(lines)
+
+def document(seed=0, size=16*1024, fences=4, languages=default_languages,
+        inline_code=0.05, urls=0.02):
+    """A markdown document of about size bytes with fences fenced blocks in
+    languages, where inline_code and urls are the fractions of prose words
+    which are inline code and naked urls."""
+    rng = random.Random(seed)
+    # spread the fences evenly through the prose
+    every = max(size // (fences + 1), 1) if fences else None
+    parts = [u"# %s" % u" ".join(rng.choice(words) for i in range(3)).title()]
+    length, placed = 0, 0
+    while length < size or placed < fences:
+        if fences and placed < fences and length >= every * (placed + 1):
+            part = fence(rng, languages[placed % len(languages)])
+            placed += 1
+        else:
+            kind = rng.random()
+            if kind < 0.1:
+                part = u"%s %s" % (u"#" * rng.randint(2, 4), paragraph(rng, 0, 0).split(u".")[0])
+            elif kind < 0.2:
+                part = u"\n".join(u"* " + paragraph(rng, inline_code, urls).split(u"\n")[0]
+                    for i in range(rng.randint(2, 6)))
+            else:
+                part = paragraph(rng, inline_code, urls)
+        parts.append(part)
+        length += len(part.encode("utf-8")) + 2
+    return u"\n\n".join(parts) + u"\n"
+
+def write_tree(directory, scenario="mixed", documents=20, seed=0):
+    """Write a tree of documents made with a scenario's parameters to
+    directory, a few to each subdirectory, returning their paths."""
+    paths = []
+    for i in range(documents):
+        subdirectory = os.path.join(directory, "section%d" % (i // 8))
+        if not os.path.isdir(subdirectory):
+            os.makedirs(subdirectory)
+        path = os.path.join(subdirectory, "doc%d.md" % i)
+        with open(path, "w") as f:
+            f.write(document(seed + i, **scenarios[scenario]).encode("utf-8"))
+        paths.append(path)
+    return paths
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    scenario = sys.argv[2] if len(sys.argv) > 2 else "mixed"
+    documents = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    paths = write_tree(sys.argv[1], scenario, documents)
+    print "Wrote %d %s documents to %s" % (len(paths), scenario, sys.argv[1])
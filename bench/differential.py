@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Check that redtape.gfm's output is byte for byte that of the frozen
+reference implementation in redtape.reference, and how much faster it is.
+
+Random documents, made of the pieces gfm is most likely to get wrong, and
+documents from each bench/corpus.py scenario are run through both, along
+with any markdown files given.  Each path compares a way of calling
+redtape.gfm against the reference: gfm with fences formatted for bootstrap,
+unformatted, and pygmentized (uncached, and from a warm highlight cache),
+and gfmd, which runs markdown on the result.
+
+When a document's output differs, it's minimized to a small reproducer by
+deleting lines and then characters for as long as the output still differs,
+and the reproducer is printed with both outputs.  The run fails if any path
+differs.  Otherwise the total time of each side and their ratio is printed:
+
+    $ python bench/differential.py [-k path] [--random N] [--seed N] [file.md ...]
+"""
+
+import os
+import sys
+import time
+import codecs
+import random
+import shutil
+import tempfile
+from optparse import OptionParser
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_dir))
+sys.path.insert(0, bench_dir)
+
+import corpus
+from redtape import gfm, reference
+from redtape.cache import HighlightCache
+
+parser = OptionParser(usage="%prog [options] [file.md ...]")
+parser.add_option("-k", "--filter", help="only check paths with this in their name")
+parser.add_option("", "--random", type="int", default=300, help="random documents to check (default %default)")
+parser.add_option("", "--seed", type="int", default=0, help="seed for the random documents (default %default)")
+parser.add_option("", "--no-corpus", action="store_true", help="don't check the corpus scenarios")
+
+# The pieces random documents are made of: block delimiters which may or may
+# not pair up, underscores in and around words, urls, and line structure.
+pieces = [u"```", u"```python\n", u"```nosuchlang\n", u"```\n#!/bin/sh\n", u"```\n<?php ",
+    u"`", u"<pre>", u"</pre>",
+    u"_", u"__", u"foo_bar_baz", u"a_b", u"_c_", u"x__y_z", u"http://example.com/a_b ",
+    u" https://example.com?a=1&b=2", u"http:", u"\n", u"\n\n", u"    ", u"\t", u" ",
+    u"# ", u"* ", u"1. ", u"> ", u"<b>", u"<div>", u"[a]: /b", u"word", u"x = 1",
+    u"naïve", u"{gfm-placeholder-0}", u"*", u"\\"]
+
+def random_document(rng):
+    return u"".join(rng.choice(pieces) for i in range(rng.randint(0, 60)))
+
+def documents(opts, args):
+    """The (name, text) pairs to check."""
+    rng = random.Random(opts.seed)
+    for i in range(opts.random):
+        yield "random/%d" % i, random_document(rng)
+    if not opts.no_corpus:
+        for scenario in sorted(corpus.scenarios):
+            yield "corpus/%s" % scenario, corpus.document(opts.seed, **corpus.scenarios[scenario])
+    for path in args:
+        with codecs.open(path, encoding="utf-8") as f:
+            yield path, f.read()
+
+def paths(cache):
+    """The (name, function, reference function) triples to compare."""
+    return [
+        ("gfm/bootstrap", gfm.gfm, reference.gfm),
+        ("gfm/none", lambda text: gfm.gfm(text, None), lambda text: reference.gfm(text, None)),
+        ("gfm/pygments", lambda text: gfm.gfm(text, "pygments"),
+            lambda text: reference.gfm(text, "pygments")),
+        ("gfm/pygments-cached", lambda text: gfm.gfm(text, "pygments", cache=cache),
+            lambda text: reference.gfm(text, "pygments")),
+        ("gfmd/bootstrap", gfm.gfmd, reference.gfmd),
+    ]
+
+def outcome(func, text):
+    """What func does with text: its output, or the type of error it raised."""
+    try:
+        return func(text)
+    except Exception, e:
+        return "raised %s" % type(e).__name__
+
+def minimize(text, fails):
+    """Shrink text for as long as fails(text) holds, by deleting runs of
+    lines and then of characters, and return what's left."""
+    for split in (lambda text: text.splitlines(True), list):
+        parts, n = split(text), 2
+        while len(parts) > 1:
+            size = max(len(parts) // n, 1)
+            for start in range(0, len(parts), size):
+                candidate = parts[:start] + parts[start+size:]
+                if fails(u"".join(candidate)):
+                    parts, n = candidate, max(n - 1, 2)
+                    break
+            else:
+                if size == 1:
+                    break
+                n = min(n * 2, len(parts))
+        text = u"".join(parts)
+    return text
+
+def check(name, func, ref, docs):
+    """Compare func against ref on each of docs, printing the minimized
+    reproducer of the first difference.  Returns whether they all matched,
+    and the time each side took."""
+    elapsed = [0.0, 0.0]
+    for doc, text in docs:
+        start = time.time()
+        expected = outcome(ref, text)
+        elapsed[0] += time.time() - start
+        start = time.time()
+        got = outcome(func, text)
+        elapsed[1] += time.time() - start
+        if got != expected:
+            fails = lambda text: outcome(func, text) != outcome(ref, text)
+            small = minimize(text, fails)
+            print "%s differs on %s, which minimizes to:" % (name, doc)
+            print "    %r" % small
+            print "reference: %r" % outcome(ref, small)
+            print "gfm:       %r" % outcome(func, small)
+            return False, elapsed
+    return True, elapsed
+
+def main():
+    opts, args = parser.parse_args()
+    docs = list(documents(opts, args))
+    directory = tempfile.mkdtemp()
+    failed = []
+    try:
+        cache = HighlightCache(directory)
+        print "%-20s %10s %10s %8s" % ("path", "ref ms", "gfm ms", "speedup")
+        for name, func, ref in paths(cache):
+            if opts.filter and opts.filter not in name:
+                continue
+            if "cached" in name:
+                for doc, text in docs:
+                    outcome(func, text)
+            ok, (ref_time, time_taken) = check(name, func, ref, docs)
+            if not ok:
+                failed.append(name)
+                continue
+            print "%-20s %10.1f %10.1f %7.2fx" % (name, ref_time * 1000, time_taken * 1000,
+                ref_time / time_taken if time_taken else 0)
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        print "%d of the paths differ from the reference: %s" % (len(failed), ", ".join(failed))
+        return 1
+    print "All paths matched the reference on %d documents" % len(docs)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
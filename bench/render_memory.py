@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compare the peak memory of writing a rendered page as one string against
+streaming it to the file.
+
+Each mode runs in its own process, which renders a large synthetic HTML
+fragment with --embed assets and reports how much its peak RSS grew while
+writing the page:
+
+    $ python bench/render_memory.py [fragment size in MB]
+"""
+
+import os
+import sys
+import tempfile
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def fragment(megabytes):
+    paragraph = u"<p>Lorem ipsum dolor sit amet, <code>consectetur</code> adipiscing élit.</p>\n"
+    return paragraph * (megabytes * 1024 * 1024 / len(paragraph))
+
+def run(mode, megabytes):
+    from redtape import script
+    from redtape.renderer import Renderer
+    renderer = Renderer(embed=True)
+    document = fragment(megabytes)
+    fd, path = tempfile.mkstemp(suffix=".html")
+    os.close(fd)
+    before = peak_rss_kb()
+    if mode == "string":
+        with open(path, "w") as f:
+            f.write(renderer.page(document).encode("utf-8"))
+    else:
+        script.write_stream(renderer.generate(document), path)
+    grown = peak_rss_kb() - before
+    os.remove(path)
+    print grown
+
+def main():
+    if len(sys.argv) > 2:
+        return run(sys.argv[1], int(sys.argv[2]))
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print "Peak RSS growth while writing a %d MB page:" % megabytes
+    for mode in ("string", "stream"):
+        output = subprocess.check_output([sys.executable, __file__, mode, str(megabytes)])
+        print "  %-6s %8.1f MB" % (mode, int(output) / 1024.0)
+
+if __name__ == "__main__":
+    main()
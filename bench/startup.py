@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Time how long rt takes to start and finish for each of its command line
+paths, the way editor integrations run it: as a new process every time.
+
+Each path is run several times in a scratch directory with its own highlight
+and template cache, and the fastest and median wall times are reported.  The
+first run of a path is cold, with nothing cached; the rest are warm:
+
+    $ python bench/startup.py [runs]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+document = u"""# Startup
+
+Some *text*, a [link](http://example.com) and a table of contents.
+
+```python
+def main():
+    return 0
+```
+"""
+
+# (name, arguments to rt, whether each run starts from a clean directory)
+paths = [
+    ("import", None, False),
+    ("--version", ["--version"], False),
+    ("--help", ["--help"], False),
+    ("--create-assets", ["--create-assets"], True),
+    ("render", ["-f", "doc.md"], False),
+    ("render --embed", ["-f", "--embed", "doc.md"], False),
+    ("render --prettify", ["-f", "--prettify", "doc.md"], False),
+    ("render unchanged", ["doc.md"], False),
+]
+
+def command(args):
+    if args is None:
+        return [sys.executable, "-c", "import redtape.script"]
+    return [sys.executable, os.path.join(root, "bin", "rt")] + args
+
+def run(args, directory, env):
+    start = time.time()
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call(command(args), cwd=directory, env=env, stdout=devnull)
+    return time.time() - start
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ, XDG_CACHE_HOME=os.path.join(directory, "cache"),
+        PYTHONPATH=os.pathsep.join([root, os.environ.get("PYTHONPATH", "")]))
+    try:
+        with open(os.path.join(directory, "doc.md"), "w") as f:
+            f.write(document.encode("utf-8"))
+        print "%-20s %9s %9s %9s" % ("path", "cold ms", "min ms", "median ms")
+        for name, args, clean in paths:
+            times = []
+            for i in range(runs):
+                if clean and os.path.exists(os.path.join(directory, "assets")):
+                    shutil.rmtree(os.path.join(directory, "assets"))
+                times.append(run(args, directory, env))
+            warm = sorted(times[1:]) or times
+            print "%-20s %9.1f %9.1f %9.1f" % (name, times[0] * 1000,
+                warm[0] * 1000, warm[len(warm) // 2] * 1000)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks for each stage of rendering, and for whole builds, over the
+documents made by bench/corpus.py.
+
+The stages are timed in this process, on one document of each corpus
+scenario: removing code blocks, gfm's line transforms, highlighting fences
+with pygments, markdown, finding the title, rendering the template, and
+Renderer.convert as a whole.  Builds run rt as a new process on a tree of
+documents, once rebuilding everything and once with nothing changed.  Each
+benchmark reports the best of several runs, in seconds.
+
+Baselines are stored as json, and compare fails when a benchmark is slower
+than its baseline by more than the threshold.  Timings depend on the
+machine, so none are committed; save one on the machine you compare on:
+
+    $ python bench/suite.py run [-k filter]
+    $ python bench/suite.py save [baseline.json]
+    $ python bench/suite.py compare [baseline.json] [--threshold 0.15]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(bench_dir)
+sys.path.insert(0, root)
+sys.path.insert(0, bench_dir)
+
+import corpus
+from redtape import gfm
+from redtape.renderer import Renderer
+
+default_baseline = os.path.join(bench_dir, "baseline.json")
+
+parser = OptionParser(usage="%prog run|save|compare [baseline.json]")
+parser.add_option("-k", "--filter", help="only run benchmarks with this in their name")
+parser.add_option("-o", "--output", help="also write the results to this json file")
+parser.add_option("", "--threshold", type="float", default=0.15,
+    help="fraction slower than the baseline that counts as a regression (default %default)")
+parser.add_option("", "--repeat", type="int", default=5, help="runs of each benchmark (default %default)")
+parser.add_option("", "--documents", type="int", default=24, help="documents in each build tree (default %default)")
+
+def measure(func, repeat=5, min_time=0.05):
+    """The best time of repeat runs of func, in seconds.  Fast functions are
+    called in batches taking at least min_time, and the batch time divided."""
+    number = 1
+    while True:
+        start = time.time()
+        for i in xrange(number):
+            func()
+        elapsed = time.time() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    best = elapsed
+    for i in xrange(repeat - 1):
+        start = time.time()
+        for j in xrange(number):
+            func()
+        best = min(best, time.time() - start)
+    return best / number
+
+stages = ("remove_blocks", "transform", "fenced_pygments", "markdown", "find_title",
+    "template", "convert")
+
+def wanted(opts, names):
+    return not opts.filter or any(opts.filter in name for name in names)
+
+def stage_benchmarks(scenario):
+    """The (name, function) pairs timing each stage on a document of
+    scenario, in pipeline order."""
+    text = corpus.document(0, **corpus.scenarios[scenario])
+    removed, blocks = gfm.remove_blocks(text)
+    fences = [block for kind, block in blocks if kind == gfm.FENCED]
+    prepared = gfm.gfm(text, "pygments")
+    renderer = Renderer(fenced="pygments")
+    html = renderer.convert(text)
+    title, outline = renderer.title, renderer.outline
+
+    def markdown():
+        renderer.markdown.reset()
+        renderer.outline_processor.reset()
+        renderer.markdown.convert(prepared)
+
+    benchmarks = [
+        ("remove_blocks", lambda: gfm.remove_blocks(text)),
+        ("transform", lambda: gfm.transform(removed)),
+    ]
+    if fences:
+        benchmarks.append(("fenced_pygments", lambda: gfm.highlight_fences(fences)))
+    benchmarks += [
+        ("markdown", markdown),
+        ("find_title", renderer.find_title),
+        ("template", lambda: renderer.page(html, title=title, outline=outline)),
+        ("convert", lambda: renderer.convert(text)),
+    ]
+    return [("%s/%s" % (name, scenario), func) for name, func in benchmarks]
+
+def build_benchmarks(scenario, documents, directory):
+    """The (name, function) pairs timing rt building a tree of documents of
+    scenario in directory, from scratch and with nothing changed."""
+    source = os.path.join(directory, scenario)
+    corpus.write_tree(source, scenario, documents)
+    output = os.path.join(directory, scenario + "-html")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get("PYTHONPATH", "")]))
+    def rt(*args):
+        command = [sys.executable, os.path.join(root, "bin", "rt"), "-r", "--no-cache",
+            "-o", output] + list(args) + [source]
+        with open(os.devnull, "w") as devnull:
+            subprocess.check_call(command, cwd=directory, env=env, stdout=devnull)
+    rt()
+    return [
+        ("build/%s" % scenario, lambda: rt("-f")),
+        ("build-unchanged/%s" % scenario, rt),
+    ]
+
+def run(opts):
+    """Run the benchmarks, printing each as it finishes, and return a dict of
+    their times."""
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        benchmarks = []
+        for scenario in sorted(corpus.scenarios):
+            if wanted(opts, ["%s/%s" % (stage, scenario) for stage in stages]):
+                benchmarks += stage_benchmarks(scenario)
+        for scenario in ("prose", "mixed", "code"):
+            if wanted(opts, ["build/%s" % scenario, "build-unchanged/%s" % scenario]):
+                benchmarks += build_benchmarks(scenario, opts.documents, directory)
+        for name, func in benchmarks:
+            if opts.filter and opts.filter not in name:
+                continue
+            results[name] = measure(func, opts.repeat, 0.05 if "build" not in name else 0)
+            print "%-32s %10.4f ms" % (name, results[name] * 1000)
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+def save(results, path):
+    with open(path, "w") as f:
+        json.dump({"python": platform.python_version(), "machine": platform.node(),
+            "results": results}, f, indent=1, sort_keys=True)
+
+def compare(results, baseline, threshold):
+    """Print how results compare to baseline, returning the names of the
+    benchmarks which regressed by more than threshold."""
+    regressed = []
+    print "%-32s %10s %10s %8s" % ("benchmark", "base ms", "now ms", "ratio")
+    for name in sorted(results):
+        if name not in baseline:
+            print "%-32s %10s %10.4f %8s" % (name, "-", results[name] * 1000, "new")
+            continue
+        ratio = results[name] / baseline[name] if baseline[name] else 1.0
+        mark = ""
+        if ratio > 1 + threshold:
+            mark = "  REGRESSED"
+            regressed.append(name)
+        elif ratio < 1 - threshold:
+            mark = "  faster"
+        print "%-32s %10.4f %10.4f %8.2f%s" % (name, baseline[name] * 1000,
+            results[name] * 1000, ratio, mark)
+    return regressed
+
+def main():
+    opts, args = parser.parse_args()
+    if not args or args[0] not in ("run", "save", "compare"):
+        parser.print_usage()
+        return 2
+    command, path = args[0], args[1] if len(args) > 1 else default_baseline
+    baseline = None
+    if command == "compare":
+        if not os.path.isfile(path):
+            print "No baseline at %s; run save first" % path
+            return 2
+        with open(path) as f:
+            baseline = json.load(f)["results"]
+    results = run(opts)
+    if opts.output:
+        save(results, opts.output)
+    if command == "save":
+        save(results, path)
+        print "Saved %d benchmarks to %s" % (len(results), path)
+    elif command == "compare":
+        print
+        regressed = compare(results, baseline, opts.threshold)
+        if regressed:
+            print "%d benchmarks regressed by more than %d%%: %s" % (len(regressed),
+                opts.threshold * 100, ", ".join(regressed))
+            return 1
+        print "No regressions beyond %d%%" % (opts.threshold * 100)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+/* redtape's search box.  Searches the index rt writes with --search from
+ * the browser: put this script, from the index's search/ directory, and an
+ * <input data-rt-search> on a page, and matching pages are listed under the
+ * input as the query is typed.  Only docs.json and the shards for the
+ * query's terms are fetched, each at most once. */
+(function() {
+    var scripts = document.getElementsByTagName("script");
+    var script = document.currentScript || scripts[scripts.length - 1];
+    var base = script.src.replace(/[^\/]*$/, "");
+    var root = base.replace(/search\/$/, "");
+    var loaded = {};
+
+    function fetch(name, done) {
+        if (loaded[name]) {
+            return loaded[name].data ? done(loaded[name].data) : loaded[name].waiting.push(done);
+        }
+        var entry = loaded[name] = {waiting: [done]};
+        var xhr = new XMLHttpRequest();
+        xhr.open("GET", base + name + ".json");
+        xhr.onreadystatechange = function() {
+            if (xhr.readyState != 4) { return; }
+            entry.data = xhr.status == 200 ? JSON.parse(xhr.responseText) : {};
+            for (var i = 0; i < entry.waiting.length; i++) { entry.waiting[i](entry.data); }
+        };
+        xhr.send();
+    }
+
+    function terms(query) {
+        var words = query.toLowerCase().split(/[^0-9a-z\u00aa-\uffff]+/), found = [];
+        for (var i = 0; i < words.length; i++) {
+            if (words[i].length > 1 && !/^[0-9]+$/.test(words[i])) { found.push(words[i]); }
+        }
+        return found;
+    }
+
+    function shardName(term) {
+        var prefix = term.substr(0, 2);
+        if (/^[a-z0-9]+$/.test(prefix)) { return prefix; }
+        var bytes = unescape(encodeURIComponent(prefix)), hex = "";
+        for (var i = 0; i < bytes.length; i++) {
+            hex += ("0" + bytes.charCodeAt(i).toString(16)).slice(-2);
+        }
+        return hex;
+    }
+
+    /* call done with the pages matching every term in query, best first,
+     * each as {doc, heading, score}; the last term matches as a prefix */
+    function search(query, done) {
+        var words = terms(query), pending = words.length + 1, shards = [], docs;
+        if (!words.length) { return done([]); }
+        function ready() {
+            if (--pending) { return; }
+            var found = null;
+            for (var i = 0; i < words.length; i++) {
+                var matches = {}, shard = shards[i];
+                for (var term in shard) {
+                    if (term == words[i] || (i == words.length - 1 && term.indexOf(words[i]) == 0)) {
+                        var postings = shard[term];
+                        for (var j = 0; j < postings.length; j += 2) {
+                            var match = matches[postings[j]] || (matches[postings[j]] = {score: 0, heading: postings[j+1]});
+                            match.score += term == words[i] ? 2 : 1;
+                        }
+                    }
+                }
+                if (found) {
+                    for (var id in found) {
+                        if (!matches[id]) { delete found[id]; } else { found[id].score += matches[id].score; }
+                    }
+                } else {
+                    found = matches;
+                }
+            }
+            var results = [];
+            for (var id in found) {
+                if (docs[id]) { results.push({doc: docs[id], heading: found[id].heading, score: found[id].score}); }
+            }
+            results.sort(function(a, b) { return b.score - a.score; });
+            done(results);
+        }
+        fetch("docs", function(data) { docs = data; ready(); });
+        for (var i = 0; i < words.length; i++) {
+            (function(i) { fetch(shardName(words[i]), function(data) { shards[i] = data; ready(); }); })(i);
+        }
+    }
+
+    function attach(input) {
+        var list = document.createElement("ul");
+        list.className = "rt-search-results";
+        input.parentNode.insertBefore(list, input.nextSibling);
+        var latest = 0;
+        input.oninput = input.onkeyup = function() {
+            var query = input.value, serial = ++latest;
+            search(query, function(results) {
+                if (serial != latest) { return; }
+                list.innerHTML = "";
+                for (var i = 0; i < results.length && i < 20; i++) {
+                    var result = results[i], heading = result.doc.headings[result.heading];
+                    var item = document.createElement("li"), link = document.createElement("a");
+                    link.href = root + result.doc.url + (heading ? "#" + heading[0] : "");
+                    link.appendChild(document.createTextNode(
+                        result.doc.title + (heading && heading[1] != result.doc.title ? " \u203a " + heading[1] : "")));
+                    item.appendChild(link);
+                    list.appendChild(item);
+                }
+            });
+        };
+    }
+
+    function setup() {
+        var inputs = document.querySelectorAll("input[data-rt-search]");
+        for (var i = 0; i < inputs.length; i++) { attach(inputs[i]); }
+    }
+    if (document.readyState == "loading") {
+        document.addEventListener("DOMContentLoaded", setup);
+    } else {
+        setup();
+    }
+    window.rtSearch = search;
+})();
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A persistent, content-addressed cache for highlighted code blocks.
+
+Entries are stored as files named after a hash of everything that went into
+producing them, so a cache directory can be shared between runs and between
+projects.  A hit touches the entry's mtime, and when the cache grows past its
+size cap the least recently used entries are evicted."""
+
+import os
+import errno
+import hashlib
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "redtape")
+
+class HighlightCache(object):
+    """A cache of rendered blocks in the directory path, which is capped at
+    max_size bytes.  Hits and misses are counted for reporting."""
+    def __init__(self, path=None, max_size=64*1024*1024):
+        self.path = path or default_cache_dir()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.sizes = None
+        self.total = 0
+
+    @staticmethod
+    def key(*parts):
+        """Make a cache key out of parts, which are strings or tuples."""
+        digest = hashlib.sha1()
+        for part in parts:
+            if isinstance(part, unicode):
+                part = part.encode("utf-8")
+            elif not isinstance(part, str):
+                part = repr(part)
+            digest.update("%d:%s" % (len(part), part))
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        """Return the cached value for key, or None if there isn't one."""
+        path = self.entry_path(key)
+        try:
+            with open(path) as f:
+                value = f.read().decode("utf-8")
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Store value under key, evicting old entries if the cache is full.
+        Failing to write to the cache is not an error."""
+        path = self.entry_path(key)
+        data = value.encode("utf-8")
+        tmp = "%s.%s.tmp" % (path, os.urandom(16).encode("hex"))
+        try:
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            with open(tmp, "w") as f:
+                f.write(data)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            return
+        sizes = self.load_sizes()
+        self.total += len(data) - sizes.get(path, 0)
+        sizes[path] = len(data)
+        if self.total > self.max_size:
+            self.evict()
+
+    def load_sizes(self):
+        """Load the size of every entry in the cache, once per process."""
+        if self.sizes is None:
+            self.sizes = {}
+            for path in self.entries():
+                try:
+                    self.sizes[path] = os.path.getsize(path)
+                except OSError:
+                    pass
+            self.total = sum(self.sizes.itervalues())
+        return self.sizes
+
+    def entries(self):
+        if not os.path.isdir(self.path):
+            return
+        for prefix in os.listdir(self.path):
+            directory = os.path.join(self.path, prefix)
+            if len(prefix) != 2 or not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.endswith(".tmp"):
+                    yield os.path.join(directory, name)
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is at 3/4
+        of its cap, so that eviction isn't done on every write."""
+        sizes = self.load_sizes()
+        used = []
+        for path in sizes.keys():
+            try:
+                used.append((os.path.getmtime(path), path))
+            except OSError:
+                del sizes[path]
+        self.total = sum(sizes.itervalues())
+        for mtime, path in sorted(used):
+            if self.total <= self.max_size * 3 / 4:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.total -= sizes.pop(path)
+
+    def report(self):
+        return "Highlight cache: %d hits, %d misses" % (self.hits, self.misses)
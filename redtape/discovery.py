@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Finding the documents in a source tree.
+
+Directories are listed once each with scandir, which gets the type of every
+entry along with its name, rather than once per extension with glob and
+again by os.walk.  On Pythons without os.scandir the scandir package is used
+if it's installed, and a plain listdir otherwise.
+
+Excludes are gitignore-style patterns, matched against paths relative to
+the directory being searched:
+
+    node_modules    any file or directory named node_modules
+    build/          any directory named build
+    /drafts         drafts at the top of the tree only
+    docs/**/old     old anywhere under the top-level docs directory
+    !keep.md        keep.md, even if an earlier pattern excluded it
+
+An excluded directory isn't listed at all, so nothing under it can be
+included again."""
+
+import os
+import re
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+default_extensions = (".md", ".mdown", ".markdown")
+default_excludes = (".git/", ".hg/", ".svn/", "node_modules/")
+
+class Entry(object):
+    """The part of scandir's DirEntry that walk uses, for when there is no
+    scandir; each method costs a stat."""
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+def list_entries(directory):
+    if scandir is not None:
+        return list(scandir(directory))
+    return [Entry(directory, name) for name in os.listdir(directory)]
+
+def pattern_regex(pattern):
+    """Translate the glob in a gitignore-style pattern, without its leading
+    ! and trailing /, into a regex matching the relative paths it covers."""
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    i, parts = 0, []
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            parts.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and pattern.find(']', i + 2) > 0:
+            end = pattern.find(']', i + 2)
+            chars = pattern[i+1:end].replace('\\', '\\\\')
+            if chars[0] == '!':
+                chars = '^' + chars[1:]
+            parts.append('[%s]' % chars)
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile(('' if anchored else '(?:.*/)?') + ''.join(parts) + '$')
+
+class Excludes(object):
+    """A list of gitignore-style exclude patterns, where the last pattern
+    matching a path decides whether it is excluded."""
+    def __init__(self, patterns=()):
+        self.rules = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            negated = pattern.startswith('!')
+            pattern = pattern.lstrip('!')
+            dir_only = pattern.endswith('/')
+            self.rules.append((pattern_regex(pattern.rstrip('/')), negated, dir_only))
+
+    def excluded(self, path, is_dir=False):
+        """Return True if the relative path, using / as its separator, is
+        excluded."""
+        result = False
+        for regex, negated, dir_only in self.rules:
+            if (is_dir or not dir_only) and regex.match(path):
+                result = not negated
+        return result
+
+def walk(root, recursive=True, extensions=None, excludes=None):
+    """Yield the paths of the documents under the directory root, which are
+    the files ending in one of extensions that aren't excluded.  Each
+    directory's documents come in sorted order, before those of its
+    subdirectories.  Hidden files are skipped, and symlinked directories
+    aren't followed."""
+    extensions = tuple(extensions or default_extensions)
+    if not isinstance(excludes, Excludes):
+        excludes = Excludes(default_excludes + tuple(excludes or ()))
+    pending = [(root, '')]
+    while pending:
+        directory, prefix = pending.pop()
+        subdirs = []
+        for entry in sorted(list_entries(directory), key=lambda e: e.name):
+            relative = prefix + entry.name
+            if entry.is_dir():
+                if recursive and not entry.is_symlink() and not excludes.excluded(relative, True):
+                    subdirs.append((entry.path, relative + '/'))
+            elif (entry.name.endswith(extensions) and not entry.name.startswith('.')
+                    and entry.is_file() and not excludes.excluded(relative)):
+                yield entry.path
+        pending.extend(reversed(subdirs))
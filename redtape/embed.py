@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tree-shaking of the assets embedded in pages with --embed.
+
+Rather than inlining all of bootstrap and pygments' css into every page,
+each stylesheet is cut down to the rules whose selectors can match the
+page: every tag, class and id a selector needs must appear in it.  Classes
+that scripts add at runtime, like prettify's token classes, count as used
+whenever the script is embedded.  Prettify's language packs, which are
+never embedded otherwise, are added for the languages of the page's fenced
+blocks.
+
+The shaken css only depends on which of a stylesheet's tokens a page uses,
+so it's cached by that set, and pages with the same markup share it.
+
+Local images are inlined too, as data URIs, up to a size cap; bigger ones
+stay linked.  Each image is encoded once, however many pages use it."""
+
+import os
+import re
+import glob
+import base64
+import urllib
+import mimetypes
+
+from redtape.manifest import text_hash
+
+pkg_dir = os.path.dirname(__file__)
+
+tag_pattern = re.compile(r'<([a-zA-Z][a-zA-Z0-9-]*)')
+attr_pattern = re.compile(r'''\s(class|id)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE)
+pseudo_pattern = re.compile(r'::?[\w-]+(?:\([^)]*\))?')
+attribute_pattern = re.compile(r'\[[^\]]*\]')
+selector_token_pattern = re.compile(r'([.#]?)(-?[_a-zA-Z][\w-]*)')
+lang_pack_pattern = re.compile(r'\[((?:"[\w-]+",?)+)\]\)')
+img_src_pattern = re.compile(r'''(<img\b[^>]*?\ssrc\s*=\s*)(["'])([^"'<>]*)\2''', re.IGNORECASE)
+scheme_pattern = re.compile(r'[a-zA-Z][\w+.-]*:')
+
+# classes which scripts put on elements once the page has loaded
+runtime_tokens = {
+    "assets/js/prettify.js": ['.prettyprinted', '.linenums', 'ol', 'li', 'span',
+        '.pln', '.str', '.kwd', '.com', '.typ', '.lit', '.pun', '.opn', '.clo',
+        '.tag', '.atn', '.atv', '.dec', '.var', '.fun', '.nocode'] +
+        ['.L%d' % i for i in range(10)],
+    "assets/js/bootstrap.min.js": ['.in', '.out', '.open', '.active', '.fade',
+        '.collapse', '.modal-backdrop', '.dropdown-backdrop', '.tooltip',
+        '.tooltip-inner', '.tooltip-arrow', '.popover', '.popover-title',
+        '.popover-content', '.arrow', '.affix', '.affix-top', '.affix-bottom',
+        '.typeahead', '.next', '.prev', '.left', '.right', '.top', '.bottom'],
+}
+
+def html_tokens(html):
+    """The tag names, .classes and #ids used in html."""
+    tokens = set(tag.lower() for tag in tag_pattern.findall(html))
+    for name, double, single, bare in attr_pattern.findall(html):
+        value = double or single or bare
+        if name.lower() == 'class':
+            tokens.update('.' + cls for cls in value.split())
+        elif value.strip():
+            tokens.add('#' + value.strip())
+    return tokens
+
+def scan_tokens(fragments, tokens):
+    """Yield each of an iterable of html fragments, adding the tokens used
+    in it to the set tokens."""
+    for html in fragments:
+        tokens.update(html_tokens(html))
+        yield html
+
+def selector_tokens(selector):
+    """The tag names, .classes and #ids an element must have for selector
+    to match anything.  Pseudo classes and attributes are ignored."""
+    selector = attribute_pattern.sub('', pseudo_pattern.sub('', selector))
+    return set(prefix + name if prefix else name.lower()
+        for prefix, name in selector_token_pattern.findall(selector))
+
+def find_unquoted(css, chars, pos):
+    """The position of the first of chars in css from pos which isn't in a
+    string or comment, or len(css)."""
+    while pos < len(css):
+        c = css[pos]
+        if c in chars:
+            return pos
+        if c in '"\'':
+            end = css.find(c, pos + 1)
+            while end > 0 and css[end-1] == '\\':
+                end = css.find(c, end + 1)
+            pos = len(css) if end < 0 else end + 1
+        elif css.startswith('/*', pos):
+            end = css.find('*/', pos + 2)
+            pos = len(css) if end < 0 else end + 2
+        else:
+            pos += 1
+    return pos
+
+def matching_brace(css, pos):
+    """The position just after the } closing the block opened at pos."""
+    depth = 0
+    while pos < len(css):
+        pos = find_unquoted(css, '{}', pos)
+        if pos < len(css):
+            depth += 1 if css[pos] == '{' else -1
+            pos += 1
+            if depth == 0:
+                break
+    return pos
+
+def parse_css(css, pos=0, end=None):
+    """Parse css into a list of items, each of which is ('text', text) for
+    things which are always kept, ('rule', selectors, declarations) or
+    ('block', prelude, items) for the rules in @media and @supports."""
+    end = len(css) if end is None else end
+    items = []
+    while pos < end:
+        while pos < end and css[pos].isspace():
+            pos += 1
+        if pos >= end:
+            break
+        if css.startswith('/*', pos):
+            close = css.find('*/', pos + 2)
+            close = end if close < 0 else close + 2
+            if css.startswith('/*!', pos):
+                items.append(('text', css[pos:close]))
+            pos = close
+        elif css[pos] == '@':
+            brace = find_unquoted(css, '{;', pos)
+            if brace >= end or css[brace] == ';':
+                items.append(('text', css[pos:brace+1]))
+                pos = brace + 1
+                continue
+            close = matching_brace(css, brace)
+            prelude = css[pos:brace].strip()
+            if prelude.startswith(('@media', '@supports')):
+                items.append(('block', prelude, parse_css(css, brace + 1, close - 1)))
+            else:
+                items.append(('text', css[pos:close]))
+            pos = close
+        else:
+            brace = find_unquoted(css, '{}', pos)
+            if brace >= end or css[brace] == '}':
+                pos = brace + 1
+                continue
+            close = find_unquoted(css, '}', brace)
+            selectors = [s.strip() for s in css[pos:brace].split(',')]
+            items.append(('rule', [(s, selector_tokens(s)) for s in selectors], css[brace+1:close]))
+            pos = close + 1
+    return items
+
+def all_tokens(items):
+    """Every token used by the selectors in parsed css."""
+    tokens = set()
+    for item in items:
+        if item[0] == 'rule':
+            for selector, needed in item[1]:
+                tokens.update(needed)
+        elif item[0] == 'block':
+            tokens.update(all_tokens(item[2]))
+    return tokens
+
+def shake_css(items, tokens):
+    """Serialize parsed css, keeping only the selectors whose tokens are
+    all in tokens, and the rules and blocks with anything left in them."""
+    out = []
+    for item in items:
+        if item[0] == 'text':
+            out.append(item[1])
+        elif item[0] == 'rule':
+            selectors = [s for s, needed in item[1] if needed <= tokens]
+            if selectors:
+                out.append('%s{%s}' % (','.join(selectors), item[2]))
+        else:
+            inner = shake_css(item[2], tokens)
+            if inner:
+                out.append('%s{%s}' % (item[1], inner))
+    return '\n'.join(out)
+
+def language_packs():
+    """Map each language prettify has a pack for to the pack's asset path."""
+    packs = {}
+    for path in sorted(glob.glob(os.path.join(pkg_dir, "assets", "js", "lang-*.js"))):
+        with open(path) as f:
+            names = lang_pack_pattern.findall(f.read())
+        asset = "assets/js/" + os.path.basename(path)
+        for name in ','.join(names).split(','):
+            packs[name.strip('"')] = asset
+    return packs
+
+class Shaker(object):
+    """Shakes the css and js assets embedded in pages down to what each page
+    uses.  css and js are lists of asset paths, relative to the package."""
+    max_cached = 256
+
+    def __init__(self, css, js):
+        self.css = list(css)
+        self.js = list(js)
+        self.contents = {}
+        self.sheets = {}
+        self.cache = {}
+        self.packs = language_packs() if "assets/js/prettify.js" in self.js else {}
+        self.runtime = set()
+        for asset in self.js:
+            self.runtime.update(runtime_tokens.get(asset, ()))
+
+    def content(self, asset):
+        """The text of asset.  Some of prettify's language packs aren't
+        utf-8, and are read as latin-1 instead, as a browser would."""
+        if asset not in self.contents:
+            with open(os.path.join(pkg_dir, asset)) as f:
+                content = f.read()
+            try:
+                self.contents[asset] = content.decode("utf-8")
+            except UnicodeDecodeError:
+                self.contents[asset] = content.decode("latin-1")
+        return self.contents[asset]
+
+    def shake(self, asset, tokens):
+        """The css asset shaken down to the rules tokens can match."""
+        if asset not in self.sheets:
+            items = parse_css(self.content(asset))
+            self.sheets[asset] = (items, all_tokens(items))
+        items, used = self.sheets[asset]
+        key = (asset, frozenset(used & tokens))
+        if key not in self.cache:
+            if len(self.cache) >= self.max_cached:
+                self.cache.clear()
+            self.cache[key] = shake_css(items, key[1])
+        return self.cache[key]
+
+    def embed(self, tokens):
+        """The embed context, {'css': [...], 'js': [...]}, for a page using
+        tokens: the shaken css, and the js with prettify's language packs for
+        the page's lang-* classes after it."""
+        tokens = set(tokens) | self.runtime
+        js = list(self.js)
+        if self.packs:
+            langs = sorted(t[6:] for t in tokens if t.startswith('.lang-'))
+            packs = sorted(set(self.packs[lang] for lang in langs if lang in self.packs))
+            after = js.index("assets/js/prettify.js") + 1
+            js[after:after] = packs
+        return {
+            'css': [self.shake(asset, tokens) for asset in self.css],
+            'js': [self.content(asset) for asset in js],
+        }
+
+class ImageInliner(object):
+    """Inlines the local images in html as data URIs, up to max_size bytes
+    each.  Encoded images are kept by the hash of their content, so an image
+    used in many places, or under many names, is only encoded once; used
+    maps the path of each image inlined since the last reset to that hash.
+    The counts are of images inlined and their bytes, of those which reused
+    an earlier encoding and their bytes, and of images left linked because
+    they're too big and their bytes."""
+    def __init__(self, max_size=64*1024):
+        self.max_size = max_size
+        self.encoded = {}
+        self.files = {}
+        self.used = {}
+        self.counts = [0] * 6
+
+    def reset(self):
+        self.used = {}
+
+    def data_uri(self, path):
+        """The data URI for the image at path, or None if it should stay
+        linked."""
+        mime = mimetypes.guess_type(path)[0]
+        if not mime or not mime.startswith("image/"):
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size > self.max_size:
+            self.counts[4] += 1
+            self.counts[5] += stat.st_size
+            return None
+        key = (path, stat.st_mtime, stat.st_size)
+        digest = self.files.get(key)
+        if digest in self.encoded:
+            self.counts[2] += 1
+            self.counts[3] += stat.st_size
+        else:
+            with open(path, "rb") as f:
+                content = f.read()
+            digest = self.files[key] = text_hash(content)
+            if digest in self.encoded:
+                self.counts[2] += 1
+                self.counts[3] += len(content)
+            else:
+                self.encoded[digest] = base64.b64encode(content)
+        self.counts[0] += 1
+        self.counts[1] += stat.st_size
+        self.used[path] = digest
+        return "data:%s;base64,%s" % (mime, self.encoded[digest])
+
+    def inline(self, html, base):
+        """Replace the src of each img in html which is a relative url of a
+        local image, resolved against the directory base, with a data URI."""
+        def replace(match):
+            url = match.group(3).replace("&amp;", "&")
+            if not url or scheme_pattern.match(url) or url.startswith("/"):
+                return match.group(0)
+            url = url.split("#", 1)[0].split("?", 1)[0]
+            path = os.path.join(base, *urllib.unquote(url).split("/"))
+            uri = self.data_uri(os.path.normpath(path))
+            if uri is None:
+                return match.group(0)
+            return match.group(1) + match.group(2) + uri + match.group(2)
+        return img_src_pattern.sub(replace, html)
+
+    def report(self):
+        return ("Inlined %d images (%d bytes, %d reused for %d bytes), "
+            "left %d over the size cap linked (%d bytes)" % tuple(self.counts))
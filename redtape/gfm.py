@@ -20,145 +20,411 @@ and will format the replacement text either with pygments or make it
 easily available for twitter bootstrap's prettify integration.
 """
 
-from uuid import uuid4
+from heapq import merge
+import os
 import re
 
-def placeholder():
-    return '{gfm-placeholder-%s}' % uuid4().hex
-
-def remove_blocks(pattern, source):
-    """Given a pattern and a source, replace all matching blocks with a
-    placeholder and then return the updated source and blocks as a tuple."""
-    blocks = {}
-    match = pattern.search(source)
-    while match:
-        key = placeholder()
-        original_block = match.group(0)
-        blocks[key] = original_block
-        source = pattern.sub(key, source, count=1)
-        match = pattern.search(source)
-
-    return source, blocks
-
-def remove_fenced_blocks(source):
-    """Replace fenced code blocks with placeholders."""
-    pattern = re.compile(r'```.*?```', re.MULTILINE | re.DOTALL)
-    return remove_blocks(pattern, source)
-
-def remove_pre_blocks(source):
-    """Replace <pre> blocks with placeholders"""
-    pattern = re.compile(r'<pre>.*?</pre>', re.MULTILINE | re.DOTALL)
-    return remove_blocks(pattern, source)
-
-def remove_inline_code_blocks(source):
-    """Replace inline code blocks with placeholders."""
-    pattern = re.compile(r'`.*?`', re.DOTALL)
-    return remove_blocks(pattern, source)
-
-def get_lexer(lang, code):
-    from pygments.lexers import get_lexer_by_name, guess_lexer
-    fallback = get_lexer_by_name('text', stripnl=True, encoding='UTF-8')
-    if not lang:
-        try: return guess_lexer(code)
-        except: return fallback
-    try: return get_lexer_by_name(lang, stripnl=True, encoding='UTF-8')
-    except: return get_lexer(None, code)
-
-def fenced_pygments(block):
+from redtape import lexers, timing
+from redtape.lexers import get_lexer
+
+FENCED, PRE, CODE = 'fenced', 'pre', 'code'
+
+# Everything that can open or close a removed block: fences are tried before
+# single backticks so that ``` is seen as a fence whenever it can be one.
+block_tokens = re.compile(r'```|</?pre>|`')
+placeholder_pattern = re.compile(r'\{gfm-placeholder-([0-9a-f]+)-(\d+)\}')
+
+class Blocks(list):
+    """The (kind, block) pairs removed from a document.  Each block is stood
+    in for by a sequential placeholder carrying a nonce unique to the
+    document, so placeholders are cheap to make and can't collide with text
+    that merely looks like one."""
+    def __init__(self):
+        list.__init__(self)
+        self.nonce = os.urandom(6).encode('hex')
+
+    def add(self, kind, block):
+        """Add a block and return its placeholder."""
+        self.append((kind, block))
+        return '{gfm-placeholder-%s-%d}' % (self.nonce, len(self) - 1)
+
+    def restore(self, text):
+        """Put every block back into text in a single substitution pass.
+        Blocks which were nested in another block (eg. a fence inside of a
+        pre block) are restored along with their parent."""
+        def replace(match):
+            if match.group(1) != self.nonce:
+                return match.group(0)
+            kind, block = self[int(match.group(2))]
+            if kind != FENCED and '{gfm-placeholder-' in block:
+                return placeholder_pattern.sub(replace, block)
+            return block
+        return placeholder_pattern.sub(replace, text)
+
+def block_spans(source):
+    """Find the (start, end) spans of fenced, <pre> and inline code blocks in
+    one left-to-right scan, returning a list for each kind.
+
+    The spans are the same ones that would be found by removing every fenced
+    block first, then every pre block, then every inline block: fences win
+    over everything, and backticks inside of a pre block are ignored.  That
+    means a pre or inline block may contain other blocks, but spans never
+    partially overlap."""
+    fences, pres, codes = [], [], []
+    pos, fence_ok, pre_ok = 0, True, True
+    code_start = pre_start = saved = None
+    while True:
+        match = block_tokens.search(source, pos)
+        if match is None:
+            if pre_start is None:
+                break
+            # an unclosed <pre>; since no later one can be closed either,
+            # scan again from just after it as if it weren't there.
+            pos, code_start, fence_ok, nfences = saved
+            del fences[nfences:]
+            pre_ok, pre_start = False, None
+            continue
+        token, start, pos = match.group(), match.start(), match.end()
+        if token == '```' and fence_ok:
+            end = source.find('```', pos)
+            if end >= 0:
+                fences.append((start, end + 3))
+                pos = end + 3
+                continue
+            fence_ok = False
+        if token[0] == '`':
+            pos = start + 1
+            if pre_start is not None:
+                continue
+            if code_start is None:
+                code_start = start
+            else:
+                codes.append((code_start, pos))
+                code_start = None
+        elif token == '<pre>':
+            if pre_ok and pre_start is None:
+                pre_start = start
+                saved = (pos, code_start, fence_ok, len(fences))
+        elif pre_start is not None:
+            pres.append((pre_start, pos))
+            pre_start = None
+    return fences, pres, codes
+
+def remove_blocks(source):
+    """Replace all fenced, <pre> and inline code blocks in source with
+    placeholders, returning the updated source and the removed Blocks."""
+    fences, pres, codes = block_spans(source)
+    spans = list(merge(
+        [(s, e, FENCED) for s, e in fences],
+        [(s, e, PRE) for s, e in pres],
+        [(s, e, CODE) for s, e in codes],
+    ))
+    blocks = Blocks()
+
+    def replace(lo, hi, i):
+        # copy source[lo:hi], replacing the spans from i on that start in it
+        pieces = []
+        while i < len(spans) and spans[i][0] < hi:
+            start, end, kind = spans[i]
+            pieces.append(source[lo:start])
+            block, i = replace(start, end, i + 1)
+            pieces.append(blocks.add(kind, block))
+            lo = end
+        pieces.append(source[lo:hi])
+        return ''.join(pieces), i
+
+    if not spans:
+        return source, blocks
+    return replace(0, len(source), 0)[0], blocks
+
+fence_pattern = re.compile(r'```(?P<lang>\w+)?(?P<code>.*?)```', re.MULTILINE|re.DOTALL)
+
+def parse_fence(block):
+    """Return the language and code in a fenced block, or None if block isn't
+    a fenced block."""
+    match = fence_pattern.match(block)
+    if not match:
+        return None
+    return match.group('lang'), match.group('code') or ''
+
+linenodiv_pattern = re.compile(r'(<div class="linenodiv"><pre>)(.*?)(</pre>)', re.DOTALL)
+lineno_pattern = re.compile(r'(\d+)(?=(?:</span>)?(?:\n|$))')
+
+# bumped whenever the markup written for pygmentized blocks changes, so
+# that blocks cached with the old markup aren't used
+markup_version = 2
+
+def pygments_options(lang):
+    cls = ('code %s' % lang) if lang else 'code'
+    return {'linenos': True, 'cssclass': cls}
+
+def number_lines(html):
+    """Write the line numbers in pygments' line number table as "1.", "2.",
+    and so on, which pages used to do with jquery once they had loaded."""
+    def dot(match):
+        return match.group(1) + lineno_pattern.sub(r'\1.', match.group(2)) + match.group(3)
+    return linenodiv_pattern.sub(dot, html)
+
+def pygments_key(cache, block):
+    """The key for a pygmentized block in a HighlightCache."""
+    from pygments import __version__
+    lang, code = parse_fence(block) or (None, block)
+    options = sorted(pygments_options(lang).items())
+    return cache.key('pygments', __version__, markup_version, lang or '', code.lstrip(), options, lexers.settings())
+
+def highlight_fence(block):
     """Pygmentize a fenced block."""
     from pygments import highlight
     from pygments.formatters import HtmlFormatter
-    pattern = re.compile(r'```(?P<lang>\w+)?(?P<code>.*?)```', re.MULTILINE|re.DOTALL)
-    match = pattern.match(block)
-    if not match:
+    fence = parse_fence(block)
+    if not fence:
         return block
-    gd = match.groupdict()
-    lang = gd.get('lang', None)
-    code = gd.get('code', '').lstrip()
-    cls = ('code %s' % lang) if lang else 'code'
-    formatter = HtmlFormatter(linenos=True, cssclass=cls)
-    lexer = get_lexer(lang, code)
-    return highlight(code, lexer, formatter)
+    lang, code = fence
+    code = code.lstrip()
+    html = highlight(code, get_lexer(lang, code), HtmlFormatter(**pygments_options(lang)))
+    return number_lines(html)
+
+def highlight_fences(blocks, cache=None, pool=None):
+    """Pygmentize a list of fenced blocks, returning the results in order.
+    Results are looked up in and saved to cache, a HighlightCache, if one is
+    given, and the rest are highlighted on pool, a multiprocessing Pool, if
+    one is given."""
+    results = [None] * len(blocks)
+    keys = [None] * len(blocks)
+    todo = []
+    for i, block in enumerate(blocks):
+        if cache is not None:
+            keys[i] = pygments_key(cache, block)
+            results[i] = cache.get(keys[i])
+        if results[i] is None:
+            todo.append(i)
+    timing.count("fences highlighted", len(todo))
+    if pool is not None and len(todo) > 1:
+        # map_async with a timeout, because a plain map can't be interrupted
+        highlighted = pool.map_async(highlight_fence, [blocks[i] for i in todo]).get(1e9)
+    else:
+        highlighted = [highlight_fence(blocks[i]) for i in todo]
+    for i, html in zip(todo, highlighted):
+        results[i] = html
+        if cache is not None:
+            cache.set(keys[i], html)
+    return results
+
+def fenced_pygments(block, cache=None):
+    """Pygmentize a fenced block.  If a HighlightCache is given, the result
+    is looked up in and saved to it."""
+    return highlight_fences([block], cache)[0]
 
 def fenced_bootstrap(block):
-    """Set up a fenced block for bootstrap prettify highlighting."""
-    pattern = re.compile(r'```(?P<lang>\w+)?(?P<code>.*?)```', re.MULTILINE|re.DOTALL)
-    match = pattern.match(block)
-    if not match:
+    """Set up a fenced block for bootstrap prettify highlighting, with a
+    lang-* class for its language, if it has one, for prettify to use."""
+    fence = parse_fence(block)
+    if not fence:
         return block
-    lang = match.groupdict().get('lang', None)
-    code = match.groupdict().get('code', '')
-    return '''<pre class="prettyprint linenums">%s</pre>''' % code
-
-def gfm(text, fenced="bootstrap"):
-    """Port of github's ruby github flavored markdown pre-processor, with
-    added support for processing fenced blocks to be usable with bootstrap or
-    to be straight-up highlighted with pygments."""
-    text, fenced_blocks = remove_fenced_blocks(text)
-    text, code_blocks = remove_pre_blocks(text)
-    text, inline_blocks = remove_inline_code_blocks(text)
-
-    if fenced and fenced in ("pygments", "bootstrap"):
-        processor = fenced_pygments if fenced == "pygments" else fenced_bootstrap
-        for key,block in fenced_blocks.items():
-            fenced_blocks[key] = processor(block)
-
-    # Prevent foo_bar_baz from ending up with an italic word in the middle.
-    def italic_callback(matchobj):
-        s = matchobj.group(0)
-        # don't mess with URLs:
-        if 'http:' in s or 'https:' in s:
-            return s
-
-        return s.replace('_', '\_')
-
-    # fix italics for code blocks
-    pattern = re.compile(r'^(?! {4}|\t).*\w+(?<!_)_\w+_\w[\w_]*', re.MULTILINE | re.UNICODE)
-    text = re.sub(pattern, italic_callback, text)
-
-    # linkify naked URLs
-    regex_string = """
+    lang, code = fence
+    cls = (' lang-%s' % lang) if lang else ''
+    return '''<pre class="prettyprint linenums%s">%s</pre>''' % (cls, code)
+
+# The text transforms work on one line at a time, where a line carries along
+# any blank lines which follow it.  Each transform is a function which takes
+# such a line and returns its replacement, and all of them are applied in a
+# single pass over the text by ``transform``.
+line_pattern = re.compile(r'[^\n]*\n*')
+word_pattern = re.compile(r'\w+', re.UNICODE)
+url_pattern = re.compile("""
 (^|\s) # start of string or has whitespace before it
 (https?://[:/.?=&;a-zA-Z0-9_-]+) # the URL itself, http or https only
 (\s|$) # trailing whitespace or end of string
-"""
-    pattern = re.compile(regex_string, re.VERBOSE | re.MULTILINE | re.UNICODE)
-
-    # wrap the URL in brackets: http://foo -> [http://foo](http://foo)
-    text = re.sub(pattern, r'\1[\2](\2)\3', text)
-
-    # In very clear cases, let newlines become <br /> tags.
-    def newline_callback(matchobj):
-        if len(matchobj.group(1)) == 1:
-            return matchobj.group(0).rstrip() + '  \n'
-        else:
-            return matchobj.group(0)
+""", re.VERBOSE | re.MULTILINE | re.UNICODE)
+newline_pattern = re.compile(r'[\w\<][^\n]*(\n+)', re.UNICODE)
+
+def italic_word(word):
+    """Return True if word has an italic in the middle, ie. if it matches
+    ``\w+(?<!_)_\w+_\w``: an underscore not preceded by another, followed
+    by at least one character and then a second underscore which is not the
+    last character in the word."""
+    first = word.find('_', 1)
+    while first > 0 and word[first-1] == '_':
+        first = word.find('_', first + 1)
+    if first < 0:
+        return False
+    return word.rfind('_', 0, len(word) - 1) >= first + 2
+
+def escape_underscores(line):
+    """Prevent foo_bar_baz from ending up with an italic word in the middle.
+
+    This escapes every underscore up to the end of the last word in the
+    line which has an italic in it, which is what github does with the
+    regex ``^(?! {4}|\t).*\w+(?<!_)_\w+_\w[\w_]*``.  That regex backtracks
+    horribly on long lines, so the words are checked one at a time."""
+    if line.count('_') < 2 or line.startswith('    ') or line.startswith('\t'):
+        return line
+    eol = line.find('\n')
+    end = None
+    for match in word_pattern.finditer(line, 0, len(line) if eol < 0 else eol):
+        if italic_word(match.group(0)):
+            end = match.end()
+    if end is None:
+        return line
+    s = line[:end]
+    # don't mess with URLs:
+    if 'http:' in s or 'https:' in s:
+        return line
+    return s.replace('_', '\\_') + line[end:]
+
+def linkify_urls(line):
+    """Wrap naked URLs in brackets: http://foo -> [http://foo](http://foo)"""
+    if 'http' not in line:
+        return line
+    return url_pattern.sub(r'\1[\2](\2)\3', line)
+
+def hard_breaks(line):
+    """In very clear cases, let newlines become <br /> tags."""
+    if line.endswith('\n') and not line.endswith('\n\n') and newline_pattern.match(line):
+        return line.rstrip() + '  \n'
+    return line
+
+default_transforms = (escape_underscores, linkify_urls, hard_breaks)
+
+def transform(text, transforms=None):
+    """Run each line of text through all of the transforms in order."""
+    if transforms is None:
+        transforms = default_transforms
+    lines = []
+    for match in line_pattern.finditer(text):
+        line = match.group(0)
+        if not line:
+            continue
+        for func in transforms:
+            line = func(line)
+        lines.append(line)
+    return ''.join(lines)
+
+def gfm(text, fenced="bootstrap", transforms=None, cache=None, pool=None):
+    """Port of github's ruby github flavored markdown pre-processor, with
+    added support for processing fenced blocks to be usable with bootstrap or
+    to be straight-up highlighted with pygments.  The text outside of code
+    blocks is rewritten by the transforms, which default to the github ones
+    in ``default_transforms``.
+
+    Pygments output is cached in cache, a redtape.cache.HighlightCache, and
+    highlighted in parallel on pool, a multiprocessing Pool, if given."""
+    with timing.phase("remove_blocks"):
+        text, blocks = remove_blocks(text)
+    if timing.current is not None:
+        for kind, block in blocks:
+            timing.count("%s blocks" % kind)
 
-    pattern = re.compile(r'^[\w\<][^\n]*(\n+)', re.MULTILINE | re.UNICODE)
-    text = re.sub(pattern, newline_callback, text)
+    if fenced and fenced in ("pygments", "bootstrap"):
+        with timing.phase("highlight"):
+            fences = [i for i, (kind, block) in enumerate(blocks) if kind == FENCED]
+            if fenced == "pygments":
+                processed = highlight_fences([blocks[i][1] for i in fences], cache, pool)
+            else:
+                processed = [fenced_bootstrap(blocks[i][1]) for i in fences]
+            for i, block in zip(fences, processed):
+                blocks[i] = (FENCED, block)
+
+    with timing.phase("transform"):
+        text = transform(text, transforms)
 
     # now restore removed code blocks
-    removed_blocks = {}
-    removed_blocks.update(fenced_blocks)
-    removed_blocks.update(code_blocks)
-    removed_blocks.update(inline_blocks)
-
-    for placeholder,removed_block in removed_blocks.iteritems():
-        text = text.replace(placeholder, removed_block, 1)
-
-    return text
+    with timing.phase("restore"):
+        return blocks.restore(text)
 
-def gfmd(text, fenced="bootstrap"):
+def gfmd(text, fenced="bootstrap", transforms=None, cache=None, pool=None):
     """Run github-flavored markdown on text."""
     from markdown import markdown
-    return markdown(gfm(text, fenced))
+    return markdown(gfm(text, fenced, transforms, cache, pool))
+
+# Lines which carry on the block before them even after a blank line: the
+# indented continuations of code blocks and list items, list items, quotes
+# and link references, which markdown turns into blank lines.
+continuation_pattern = re.compile(r'[ \t]|[*+-][ \t]|\d+\.[ \t]|>|\[[^\]]*\]:')
+html_open_pattern = re.compile(r'<(?:!--|([a-zA-Z][a-zA-Z0-9]*)(?=[\s/>]|$))')
+void_tags = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img',
+    'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'])
+
+def scan_line(line, fence=False, pre=False, code=False):
+    """Follow the block tokens in a line, returning whether a fenced, <pre>
+    or inline code block is still open after it.  The flags say which ones
+    were open before it; they pair up the way ``block_spans`` does."""
+    pos = 0
+    while True:
+        if fence:
+            end = line.find('```', pos)
+            if end < 0:
+                break
+            fence, pos = False, end + 3
+            continue
+        match = block_tokens.search(line, pos)
+        if match is None:
+            break
+        token, pos = match.group(), match.end()
+        if token == '```':
+            fence = True
+        elif token == '`':
+            code = code if pre else not code
+        else:
+            pre = token == '<pre>'
+    return fence, pre, code
+
+def html_depth(line, tag, depth):
+    """The nesting depth of a raw html block of tag (None for a comment)
+    after line, given its depth before it."""
+    if tag is None:
+        return 0 if '-->' in line[4 if depth == 0 else 0:] else 1
+    opened = len(re.findall(r'<%s(?=[\s/>]|$)' % tag, line, re.IGNORECASE))
+    closed = len(re.findall(r'</%s\s*>' % tag, line, re.IGNORECASE))
+    return depth + opened - closed
+
+def split_blocks(lines, size=256*1024):
+    """Group an iterable of markdown lines into chunks of about size
+    characters which can be run through gfm and markdown one at a time, for
+    documents too large to convert whole.
+
+    A chunk only ends before a line which starts a new top-level block: one
+    which follows a blank line, isn't inside a fenced, <pre>, inline code or
+    raw html block, and doesn't continue a list, quote, indented code block
+    or link reference.  Converting each chunk and joining the results gives
+    the same HTML as converting the whole document, as long as reference
+    links are resolved across chunks."""
+    chunk, length = [], 0
+    fence = pre = code = blank = False
+    html = None
+    for line in lines:
+        content = line.strip(' \t\r\n')
+        if (length >= size and blank and content and html is None and not
+                (fence or pre or code) and not continuation_pattern.match(line)):
+            yield ''.join(chunk)
+            chunk, length = [], 0
+        chunk.append(line)
+        length += len(line)
+        blank = not content
+        if blank:
+            continue
+        if html is None and not (fence or pre or code):
+            match = html_open_pattern.match(line)
+            tag = match and match.group(1)
+            if match and (tag or '').lower() not in void_tags:
+                html = (tag, 0)
+        fence, pre, code = scan_line(line, fence, pre, code)
+        if html is not None:
+            depth = html_depth(line, html[0], html[1])
+            html = (html[0], depth) if depth > 0 else None
+    if chunk:
+        yield ''.join(chunk)
 
 # Test suite.
-try:
-    from nose.tools import assert_equal
-except ImportError:
-    def assert_equal(a, b):
+def assert_equal(a, b):
+    """nose's assert_equal, which is only imported once a test runs, as
+    importing nose is slower than everything else rt imports."""
+    try:
+        from nose.tools import assert_equal
+    except ImportError:
         assert a == b, '%r != %r' % (a, b)
+    else:
+        assert_equal(a, b)
 
 def test_single_underscores():
     """Don't touch single underscores inside words."""
@@ -260,3 +526,51 @@ def test_linkify_naked_urls():
         gfm(" http://www.example.com:80/foo?bar=bar&biz=biz"),
         " [http://www.example.com:80/foo?bar=bar&biz=biz](http://www.example.com:80/foo?bar=bar&biz=biz)"
         )
+
+def test_nested_blocks():
+    """Restore blocks that were removed from inside of other blocks."""
+    assert_equal(
+        gfm('`a ```b_c_d``` e`', fenced=None),
+        '`a ```b_c_d``` e`',
+    )
+    assert_equal(
+        gfm('<pre>\n`foo_bar_baz\n</pre> `', fenced=None),
+        '<pre>\n`foo_bar_baz\n</pre> `',
+    )
+
+def test_unclosed_blocks():
+    """Leave unclosed fences and pre blocks alone."""
+    assert_equal(
+        gfm('<pre> `foo_bar_baz` ``` a_b_c', fenced=None),
+        '<pre> `foo_bar_baz` ``` a\\_b\\_c',
+    )
+
+def test_custom_transforms():
+    """Run extra transforms on text outside of code blocks."""
+    copyright = lambda line: line.replace('(c)', '&copy;')
+    assert_equal(
+        gfm('foo_bar_baz (c)\n`(c)`', transforms=default_transforms + (copyright,)),
+        'foo\\_bar\\_baz &copy;  \n`(c)`',
+    )
+
+def test_split_blocks():
+    """Only split documents between top-level blocks."""
+    lines = ['a\n', '\n', '```\n', 'x\n', '\n', '```\n', '\n', '* b\n', '\n',
+        '* c\n', '\n', '<div>\n', '\n', '</div>\n', '\n', 'd\n']
+    assert_equal(
+        list(split_blocks(lines, 0)),
+        ['a\n\n', '```\nx\n\n```\n\n* b\n\n* c\n\n', '<div>\n\n</div>\n\n', 'd\n'],
+    )
+
+def test_number_lines():
+    """Dot the numbers in pygments' line number column, not in the code."""
+    assert_equal(
+        number_lines('<div class="linenodiv"><pre>1\n2</pre></div><pre>3\n</pre>'),
+        '<div class="linenodiv"><pre>1.\n2.</pre></div><pre>3\n</pre>',
+    )
+    assert_equal(
+        number_lines('<div class="linenodiv"><pre><span class="normal">9</span>\n'
+            '<span class="normal">10</span></pre></div>'),
+        '<div class="linenodiv"><pre><span class="normal">9.</span>\n'
+            '<span class="normal">10.</span></pre></div>',
+    )
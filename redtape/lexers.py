@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Lexer resolution for fenced blocks.
+
+Looking a lexer up by name is memoized, and blocks without a (known) language
+tag are resolved as cheaply as possible: first by sniffing shebangs and other
+unmistakable signatures, then by the project's default language if one is set,
+and only then by pygments' guess_lexer, which is run on the first few lines of
+the block rather than all of it."""
+
+import re
+
+# the language used for blocks which have no tag and can't be sniffed
+default_language = None
+# how many lines of a block are given to guess_lexer
+guess_lines = 20
+
+lexer_options = {'stripnl': True, 'encoding': 'UTF-8'}
+
+shebang = re.compile(r'#!\s*\S*/(?:env\s+)?([a-zA-Z]+)')
+interpreters = {
+    'sh': 'bash', 'zsh': 'bash', 'ksh': 'bash', 'node': 'javascript',
+    'nodejs': 'javascript', 'python': 'python', 'ruby': 'ruby', 'perl': 'perl',
+    'php': 'php', 'lua': 'lua', 'tclsh': 'tcl', 'Rscript': 'r',
+}
+signatures = [
+    (re.compile(r'<\?php'), 'php'),
+    (re.compile(r'<\?xml'), 'xml'),
+    (re.compile(r'<!DOCTYPE html|<html', re.IGNORECASE), 'html'),
+    (re.compile(r'package\s+\w+\s*$', re.MULTILINE), 'go'),
+    (re.compile(r'#include\s*[<"]'), 'cpp'),
+    (re.compile(r'diff --git |--- \S+\n\+\+\+ '), 'diff'),
+]
+
+# lower-cased names and aliases: their lexer, or None if there isn't one
+_lexers = {}
+# lexer classes: the one instance of each shared by all of its aliases, all
+# made with lexer_options
+_instances = {}
+
+def lexer_for_name(name):
+    """Return a shared lexer for a language name or alias, or None if pygments
+    doesn't know of one.  Every alias of a language gets the same lexer."""
+    name = name.lower()
+    try:
+        return _lexers[name]
+    except KeyError:
+        pass
+    from pygments.lexers import get_lexer_by_name
+    from pygments.util import ClassNotFound
+    try:
+        lexer = get_lexer_by_name(name, **lexer_options)
+    except ClassNotFound:
+        lexer = None
+    else:
+        lexer = _instances.setdefault(type(lexer), lexer)
+    _lexers[name] = lexer
+    return lexer
+
+def sniff_language(code):
+    """Return the language of code if it has an obvious shebang or signature
+    at its start, or None."""
+    head = code.lstrip()[:512]
+    match = shebang.match(head)
+    if match:
+        interpreter = match.group(1)
+        return interpreters.get(interpreter, interpreter)
+    for pattern, language in signatures:
+        if pattern.match(head):
+            return language
+    return None
+
+def guess_lexer(code, lines=None):
+    """Guess the lexer for code by looking at its first lines only."""
+    from pygments.lexers import guess_lexer
+    lines = guess_lines if lines is None else lines
+    head = '\n'.join(code.split('\n', lines)[:lines])
+    try:
+        return guess_lexer(head, **lexer_options)
+    except Exception:
+        return None
+
+def get_lexer(lang, code):
+    """Return the lexer to highlight code tagged with lang with, which is
+    resolved by name, sniffing, default language and guessing, in that order
+    of preference."""
+    if lang:
+        lexer = lexer_for_name(lang)
+        if lexer is not None:
+            return lexer
+    for name in (sniff_language(code), default_language):
+        lexer = name and lexer_for_name(name)
+        if lexer is not None:
+            return lexer
+    return guess_lexer(code) or lexer_for_name('text')
+
+def settings():
+    """The settings which affect lexer resolution, for use in cache keys."""
+    return (default_language, guess_lines)
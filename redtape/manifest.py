@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A build manifest for incremental builds.
+
+For each output file the manifest records a hash of every input that went
+into it: the source document, the templates, the header and footer and the
+options that affect rendering.  An output whose inputs hash the same as they
+did when it was last built is up to date and doesn't need to be rebuilt."""
+
+import os
+import json
+import hashlib
+
+manifest_name = ".rt-manifest"
+
+def text_hash(text):
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    return hashlib.sha1(text).hexdigest()
+
+def file_hash(path, block_size=1024*1024):
+    """The hash of the file at path, or None if it doesn't exist.  The file
+    is read a block at a time, so it's the same as the text_hash of its
+    contents without holding them in memory."""
+    digest = hashlib.sha1()
+    try:
+        with open(path) as f:
+            for block in iter(lambda: f.read(block_size), ""):
+                digest.update(block)
+    except IOError:
+        return None
+    return digest.hexdigest()
+
+class Manifest(object):
+    """The manifest stored at path, which maps output paths to a dictionary
+    of their inputs' hashes."""
+    def __init__(self, path=manifest_name):
+        self.path = path
+        self.outputs = {}
+        self.rebuilt = 0
+        self.skipped = 0
+        self.written = 0
+        self.unchanged = 0
+        try:
+            with open(path) as f:
+                self.outputs = json.load(f).get("outputs", {})
+        except (IOError, ValueError):
+            pass
+
+    def is_fresh(self, output, inputs):
+        """Return True if output exists and was built from the same inputs."""
+        return os.path.exists(output) and self.outputs.get(output) == inputs
+
+    def dependencies(self, output, name):
+        """The current hashes of the files recorded under name in output's
+        inputs when it was last built, for documents which depend on files
+        only found by rendering them, like the images they inline."""
+        previous = self.outputs.get(output, {}).get(name) or {}
+        return dict((path, file_hash(path)) for path in previous)
+
+    def update(self, output, inputs):
+        self.outputs[output] = inputs
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"outputs": self.outputs}, f, indent=1, sort_keys=True)
+        os.rename(tmp, self.path)
+
+    def report(self):
+        return "Rebuilt %d (%d written, %d identical to the existing output), skipped %d unchanged" % (
+            self.rebuilt, self.written, self.unchanged, self.skipped)
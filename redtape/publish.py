@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Publishing assets for long-term caching.
+
+Instead of copying the whole assets directory, only the css and js that
+pages link to are published, along with the images their css refers to.
+Each is published under a name carrying a hash of its content, eg.
+``assets/css/bootstrap.min.3b0c84a1d2f7.css``, so a server or CDN can cache
+them forever: changed assets get new names, and pages link the new names.
+
+Pages and assets can also get gzipped ``.gz`` sidecars, for servers which
+send precompressed files.  They're compressed at the highest level with no
+timestamp, so unchanged files compress to identical sidecars."""
+
+import os
+import re
+import gzip
+import posixpath
+
+from redtape.manifest import text_hash
+from redtape.renderer import pkg_dir
+
+css_url_pattern = re.compile(r'''url\((["']?)([^)"']+)\1\)''')
+
+def fingerprint_name(asset, content):
+    """The name of asset, a path like assets/css/x.css, with a hash of its
+    content put in front of the extension."""
+    base, ext = posixpath.splitext(asset)
+    return "%s.%s%s" % (base, text_hash(content)[:12], ext)
+
+def fingerprint_assets(assets, published=None):
+    """Map each of the assets, paths relative to the redtape package, and
+    the images their css refers to, to a tuple of its fingerprinted path and
+    the content to publish there.  The urls in css are rewritten to the
+    fingerprinted names, so a changed image changes the css's name too."""
+    published = {} if published is None else published
+    for asset in assets:
+        if asset in published:
+            continue
+        with open(os.path.join(pkg_dir, asset), "rb") as f:
+            content = f.read()
+        if asset.endswith(".css"):
+            directory = posixpath.dirname(asset)
+            def rewrite(match):
+                url = match.group(2)
+                if "//" in url or url.startswith(("data:", "/")):
+                    return match.group(0)
+                target = posixpath.normpath(posixpath.join(directory, url))
+                fingerprint_assets([target], published)
+                name = posixpath.relpath(published[target][0], directory)
+                return "url(%s%s%s)" % (match.group(1), name, match.group(1))
+            content = css_url_pattern.sub(rewrite, content)
+        published[asset] = (fingerprint_name(asset, content), content)
+    return published
+
+def publish_assets(published, directory):
+    """Write the assets from fingerprint_assets under directory, returning
+    their paths.  Assets which already exist are left alone, as a
+    fingerprinted name always has the same content."""
+    paths = []
+    for name, content in sorted(published.values()):
+        path = os.path.join(directory, *name.split("/"))
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + ".tmp", "wb") as f:
+            f.write(content)
+        os.rename(path + ".tmp", path)
+    return paths
+
+def gzip_file(path):
+    """Write a gzipped copy of path to path.gz."""
+    tmp = path + ".gz.tmp"
+    with open(path, "rb") as f:
+        with open(tmp, "wb") as out:
+            gz = gzip.GzipFile("", "wb", 9, out, mtime=0)
+            for block in iter(lambda: f.read(1024*1024), ""):
+                gz.write(block)
+            gz.close()
+    os.rename(tmp, path + ".gz")
+    return path + ".gz"
+
+def gzip_files(paths, jobs=None):
+    """Gzip each of paths, in parallel on a pool of jobs threads; zlib lets
+    go of the GIL while it compresses."""
+    from multiprocessing.pool import ThreadPool
+    if len(paths) < 2:
+        return map(gzip_file, paths)
+    pool = ThreadPool(jobs)
+    try:
+        return pool.map(gzip_file, paths)
+    finally:
+        pool.close()
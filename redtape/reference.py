@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A frozen reference implementation of redtape.gfm's gfm and gfmd.
+
+This is the github gist's pre-processor as redtape first shipped it: each
+kind of code block is removed with its own regular expression, the text is
+rewritten by a regular expression per rewrite, and the blocks are put back
+one at a time.  Fenced blocks are formatted the way pages are published
+today, with a lang-* class for prettify and with dotted pygments line
+numbers.  Lexers are resolved as redtape.lexers does with its default
+settings, by a copy of its rules.  It's slow, but its output is what
+redtape.gfm is checked against by bench/differential.py, so don't change it
+unless the published output is meant to change too."""
+
+import os
+import re
+
+fenced_pattern = re.compile(r'```.*?```', re.MULTILINE | re.DOTALL)
+pre_pattern = re.compile(r'<pre>.*?</pre>', re.MULTILINE | re.DOTALL)
+inline_pattern = re.compile(r'`.*?`', re.DOTALL)
+fence_pattern = re.compile(r'```(?P<lang>\w+)?(?P<code>.*?)```', re.MULTILINE|re.DOTALL)
+italic_pattern = re.compile(r'^(?! {4}|\t).*\w+(?<!_)_\w+_\w[\w_]*', re.MULTILINE | re.UNICODE)
+url_pattern = re.compile("""
+(^|\s) # start of string or has whitespace before it
+(https?://[:/.?=&;a-zA-Z0-9_-]+) # the URL itself, http or https only
+(\s|$) # trailing whitespace or end of string
+""", re.VERBOSE | re.MULTILINE | re.UNICODE)
+newline_pattern = re.compile(r'^[\w\<][^\n]*(\n+)', re.MULTILINE | re.UNICODE)
+linenodiv_pattern = re.compile(r'(<div class="linenodiv"><pre>)(.*?)(</pre>)', re.DOTALL)
+lineno_pattern = re.compile(r'(\d+)(?=(?:</span>)?(?:\n|$))')
+
+lexer_options = {'stripnl': True, 'encoding': 'UTF-8'}
+guess_lines = 20
+shebang_pattern = re.compile(r'#!\s*\S*/(?:env\s+)?([a-zA-Z]+)')
+interpreters = {
+    'sh': 'bash', 'zsh': 'bash', 'ksh': 'bash', 'node': 'javascript',
+    'nodejs': 'javascript', 'python': 'python', 'ruby': 'ruby', 'perl': 'perl',
+    'php': 'php', 'lua': 'lua', 'tclsh': 'tcl', 'Rscript': 'r',
+}
+signatures = [
+    (re.compile(r'<\?php'), 'php'),
+    (re.compile(r'<\?xml'), 'xml'),
+    (re.compile(r'<!DOCTYPE html|<html', re.IGNORECASE), 'html'),
+    (re.compile(r'package\s+\w+\s*$', re.MULTILINE), 'go'),
+    (re.compile(r'#include\s*[<"]'), 'cpp'),
+    (re.compile(r'diff --git |--- \S+\n\+\+\+ '), 'diff'),
+]
+
+def lexer_for_name(name):
+    from pygments.lexers import get_lexer_by_name
+    from pygments.util import ClassNotFound
+    try:
+        return get_lexer_by_name(name.lower(), **lexer_options)
+    except ClassNotFound:
+        return None
+
+def get_lexer(lang, code):
+    """The lexer for code tagged with lang: the one named by lang, else one
+    for an obvious shebang or signature at the start of code, else the one
+    guess_lexer picks from its first lines, else the text lexer."""
+    from pygments.lexers import guess_lexer
+    lexer = lang and lexer_for_name(lang)
+    if lexer:
+        return lexer
+    head = code.lstrip()[:512]
+    match = shebang_pattern.match(head)
+    if match:
+        name = interpreters.get(match.group(1), match.group(1))
+    else:
+        name = next((name for pattern, name in signatures if pattern.match(head)), None)
+    lexer = name and lexer_for_name(name)
+    if lexer:
+        return lexer
+    try:
+        return guess_lexer('\n'.join(code.split('\n', guess_lines)[:guess_lines]), **lexer_options)
+    except Exception:
+        return lexer_for_name('text')
+
+def remove_blocks(pattern, source, removed):
+    """Replace every block matching pattern in source with a placeholder,
+    appending the (placeholder, block) pairs to removed."""
+    def replace(match):
+        key = '{gfm-placeholder-%s}' % os.urandom(16).encode('hex')
+        removed.append((key, match.group(0)))
+        return key
+    return pattern.sub(replace, source)
+
+def fenced_pygments(block):
+    """Pygmentize a fenced block."""
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    match = fence_pattern.match(block)
+    if not match:
+        return block
+    lang = match.group('lang')
+    code = (match.group('code') or '').lstrip()
+    cls = ('code %s' % lang) if lang else 'code'
+    formatter = HtmlFormatter(linenos=True, cssclass=cls)
+    html = highlight(code, get_lexer(lang, code), formatter)
+    def dot(match):
+        return match.group(1) + lineno_pattern.sub(r'\1.', match.group(2)) + match.group(3)
+    return linenodiv_pattern.sub(dot, html)
+
+def fenced_bootstrap(block):
+    """Set up a fenced block for bootstrap prettify highlighting."""
+    match = fence_pattern.match(block)
+    if not match:
+        return block
+    lang = match.group('lang')
+    cls = (' lang-%s' % lang) if lang else ''
+    return '''<pre class="prettyprint linenums%s">%s</pre>''' % (cls, match.group('code') or '')
+
+def gfm(text, fenced="bootstrap"):
+    """Run the github flavored markdown pre-processor over text, formatting
+    fenced blocks for bootstrap or with pygments."""
+    fenced_blocks, removed = [], []
+    text = remove_blocks(fenced_pattern, text, fenced_blocks)
+    text = remove_blocks(pre_pattern, text, removed)
+    text = remove_blocks(inline_pattern, text, removed)
+
+    if fenced in ("pygments", "bootstrap"):
+        processor = fenced_pygments if fenced == "pygments" else fenced_bootstrap
+        fenced_blocks = [(key, processor(block)) for key, block in fenced_blocks]
+
+    # Prevent foo_bar_baz from ending up with an italic word in the middle.
+    def italic_callback(matchobj):
+        s = matchobj.group(0)
+        # don't mess with URLs:
+        if 'http:' in s or 'https:' in s:
+            return s
+        return s.replace('_', '\_')
+    text = italic_pattern.sub(italic_callback, text)
+
+    # wrap the URL in brackets: http://foo -> [http://foo](http://foo)
+    text = url_pattern.sub(r'\1[\2](\2)\3', text)
+
+    # In very clear cases, let newlines become <br /> tags.
+    def newline_callback(matchobj):
+        if len(matchobj.group(1)) == 1:
+            return matchobj.group(0).rstrip() + '  \n'
+        return matchobj.group(0)
+    text = newline_pattern.sub(newline_callback, text)
+
+    # Blocks removed later may contain the placeholders of ones removed
+    # earlier, so they're put back last removed first.
+    for key, block in reversed(fenced_blocks + removed):
+        text = text.replace(key, block, 1)
+    return text
+
+def gfmd(text, fenced="bootstrap"):
+    """Run github-flavored markdown on text."""
+    from markdown import markdown
+    return markdown(gfm(text, fenced))
@@ -0,0 +1,448 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A reusable renderer for embedding redtape in other programs.
+
+A Renderer is set up once with the fence mode, template, header, footer and
+asset settings, and keeps a markdown converter and compiled template around
+between documents, so rendering many documents doesn't pay for setting them
+up every time:
+
+    renderer = Renderer(fenced="pygments", embed=True)
+    page = renderer.render(text)
+    for page in renderer.render_many(texts):
+        ...
+"""
+
+import os
+import re
+import codecs
+import tempfile
+from HTMLParser import HTMLParser
+
+from redtape import gfm, timing
+
+pkg_dir = os.path.dirname(__file__)
+asset_path = os.path.join(pkg_dir, "assets")
+
+heading_tags = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+# markdown's placeholders for stashed raw html and for escaped characters
+stash_pattern = re.compile(u'\x02wzxhzdk:(\\d+)\x03')
+escape_pattern = re.compile(u'\x02(\\d+)\x03')
+tag_pattern = re.compile(r'<[^>]*>')
+h1_pattern = re.compile(r'<h1[^>]*>(.*?)</h1>', re.IGNORECASE | re.DOTALL)
+# stands in for a document kept in a file while the page around it renders
+document_marker = u'\x00redtape-document\x00'
+# ends every chunk of a document but the last, so that markdown keeps the
+# whitespace between the chunk and the next one
+chunk_marker = u'redtapechunkend'
+# put around the document in pages marked for the search index, which only
+# indexes what's between them
+document_start = u'<!-- rt:document -->'
+document_end = u'<!-- /rt:document -->'
+
+def slugify(text):
+    slug = re.sub(r'[^\w\s-]', '', text.lower(), flags=re.UNICODE).strip()
+    return re.sub(r'[-\s]+', '-', slug, flags=re.UNICODE) or 'section'
+
+def html_text(html):
+    """The text content of a snippet of html."""
+    return HTMLParser().unescape(tag_pattern.sub('', html))
+
+def outline_processor(md):
+    """Make a markdown treeprocessor which collects the headings of each
+    document it processes into its outline attribute, giving every heading a
+    unique id to link to.  It is made lazily so that markdown is only
+    imported when it's used."""
+    from markdown.treeprocessors import Treeprocessor
+
+    class OutlineProcessor(Treeprocessor):
+        def reset(self):
+            """Start a new document.  Documents converted in chunks are one
+            document, so their headings are collected and kept unique across
+            every chunk."""
+            self.outline = []
+            self.ids = set()
+
+        def run(self, root):
+            ids = self.ids
+            ids.update(el.get('id') for el in root.iter() if el.get('id'))
+            for el in root.iter():
+                if el.tag not in heading_tags:
+                    continue
+                text = self.text(el)
+                anchor = el.get('id')
+                if not anchor:
+                    anchor = base = slugify(text)
+                    count = 1
+                    while anchor in ids:
+                        count += 1
+                        anchor = '%s-%d' % (base, count)
+                    ids.add(anchor)
+                    el.set('id', anchor)
+                self.outline.append({'level': int(el.tag[1]), 'text': text, 'id': anchor})
+
+        def text(self, el):
+            """The text of an element, with markdown's placeholders for raw
+            html and escaped characters resolved."""
+            def stashed(match):
+                html = self.md.htmlStash.rawHtmlBlocks[int(match.group(1))]
+                if not isinstance(html, basestring):
+                    return u''.join(html.itertext())
+                return html_text(html)
+            text = escape_pattern.sub(lambda m: unichr(int(m.group(1))), u''.join(el.itertext()))
+            return stash_pattern.sub(stashed, text).strip()
+
+    processor = OutlineProcessor(md)
+    processor.reset()
+    # run after inline processing, so that headings have their final text
+    md.treeprocessors.register(processor, 'outline', 5)
+    return processor
+
+def references_processor(md):
+    """Make a markdown preprocessor which adds the link references in its
+    references attribute to those defined in each document, overriding
+    them, for converting documents in chunks whose references were all
+    collected beforehand."""
+    from markdown.preprocessors import Preprocessor
+
+    class ReferencesProcessor(Preprocessor):
+        def run(self, lines):
+            self.md.references.update(self.references)
+            return lines
+
+    processor = ReferencesProcessor(md)
+    processor.references = {}
+    # run right after markdown's own reference preprocessor
+    md.preprocessors.register(processor, 'references', 5)
+    return processor
+
+def spool(fragments):
+    """Write an iterable of unicode fragments to a temporary file, returning
+    a reader for their text from the start of it."""
+    f = tempfile.TemporaryFile()
+    writer = codecs.getwriter("utf-8")(f)
+    for fragment in fragments:
+        writer.write(fragment)
+    f.seek(0)
+    return codecs.getreader("utf-8")(f)
+
+def splice(chunks, document, size=64*1024):
+    """Yield the chunks of a page, with the text read from the file object
+    document in place of the document marker.  document is closed once the
+    page is done."""
+    try:
+        for chunk in chunks:
+            if document_marker not in chunk:
+                yield chunk
+                continue
+            before, after = chunk.split(document_marker, 1)
+            yield before
+            data = document.read(size)
+            while data:
+                yield data
+                data = document.read(size)
+            yield after
+    finally:
+        document.close()
+
+# jinja2 environments by their template paths and bytecode cache directory
+environments = {}
+
+def template_environment(template_paths, cache_dir=None):
+    """The jinja2 environment loading templates from template_paths, which is
+    made once and reused, so each template is only compiled once.  With a
+    cache_dir, compiled templates are kept there between runs too."""
+    key = (tuple(template_paths), cache_dir)
+    if key not in environments:
+        import jinja2
+        bytecode_cache = None
+        if cache_dir:
+            if not os.path.isdir(cache_dir):
+                try:
+                    os.makedirs(cache_dir)
+                except OSError:
+                    pass
+            if os.path.isdir(cache_dir):
+                bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+        environments[key] = jinja2.Environment(loader=jinja2.FileSystemLoader(template_paths),
+            bytecode_cache=bytecode_cache)
+    return environments[key]
+
+def load_template(path=None, cache_dir=None):
+    """Load the template at path, or the default basic.jinja template.  The
+    assets directory is always on the search path, so that custom templates
+    can inherit from the default one.  cache_dir is a directory to keep
+    compiled templates in between runs."""
+    template_paths = [asset_path]
+    template = "basic.jinja"
+    if path:
+        extra, template = os.path.split(os.path.abspath(path))
+        template_paths.append(extra)
+    return template_environment(template_paths, cache_dir).get_template(template)
+
+def asset_context(prettify=False, embed=False, use_js=False):
+    """The template context for the css and js assets of a page."""
+    context = {}
+    context['prettify'] = prettify
+
+    css = [
+        "assets/css/bootstrap.min.css",
+        "assets/css/%s" % ("prettify.css" if prettify else "pygments.css"),
+    ]
+    js = [] if not use_js else [
+        "assets/js/jquery.min.js",
+        "assets/js/bootstrap.min.js",
+    ]
+
+    if prettify: # if prettifying, link prettify no matter what
+        js.append("assets/js/prettify.js")
+
+    context['js'] = js
+    context['css'] = css
+
+    if embed:
+        embed = {'css':[], 'js':[]}
+        for csf in css:
+            with open(os.path.join(pkg_dir, csf)) as f:
+                embed['css'].append(f.read().decode("utf-8"))
+        for jsf in js:
+            with open(os.path.join(pkg_dir, jsf)) as f:
+                embed['js'].append(f.read().decode("utf-8"))
+        context['embed'] = embed
+    else:
+        context['embed'] = None
+    return context
+
+class Renderer(object):
+    """Renders github flavored markdown into HTML pages.
+
+    fenced is the gfm fence mode, "pygments" or "bootstrap".  template is a
+    jinja2 template or the path to one, and defaults to basic.jinja.  header
+    and footer are HTML put around every document.  embed inlines css and js
+    in the page rather than linking it, and shake trims what's inlined down
+    to what each page uses; use_js adds jquery and bootstrap's js.  When
+    embedding, local images up to inline_images bytes are inlined too, for
+    documents converted with a base directory.  cache and pool are passed on
+    to gfm for highlighting fenced blocks, and transforms replaces gfm's
+    text transforms.  mark_document puts comments around the document in
+    each page, for the search index to find it by."""
+    def __init__(self, fenced="pygments", template=None, header="", footer="",
+            embed=False, use_js=False, cache=None, pool=None, transforms=None,
+            shake=False, inline_images=0, mark_document=False):
+        from markdown import Markdown
+        self.fenced = fenced
+        if template is None or isinstance(template, basestring):
+            template = load_template(template)
+        self.template = template
+        self.header = header
+        self.footer = footer
+        self.context = asset_context(fenced == "bootstrap", embed, use_js)
+        self.shaker = None
+        if embed and shake:
+            from redtape.embed import Shaker
+            self.shaker = Shaker(self.context['css'], self.context['js'])
+        self.images = None
+        if embed and inline_images:
+            from redtape.embed import ImageInliner
+            self.images = ImageInliner(inline_images)
+        self.cache = cache
+        self.pool = pool
+        self.transforms = transforms
+        self.mark_document = mark_document
+        self.markdown = Markdown()
+        self.outline_processor = outline_processor(self.markdown)
+        self.references_processor = references_processor(self.markdown)
+        self.outline = []
+        self.title = ""
+
+    def convert(self, text, base=None):
+        """Convert markdown text into an HTML fragment.  The headings of the
+        document are collected into the outline attribute as it's converted:
+        a list of dicts with the level, text and id of each heading.  base is
+        the directory the document's image paths are relative to."""
+        text = gfm.gfm(text, self.fenced, self.transforms, self.cache, self.pool)
+        with timing.phase("markdown"):
+            self.markdown.reset()
+            self.outline_processor.reset()
+            html = self.markdown.convert(text)
+        html = self.inline_images(html, base)
+        self.outline = self.outline_processor.outline
+        with timing.phase("title"):
+            self.title = self.find_title()
+        return html
+
+    def inline_images(self, html, base=None, reset=True):
+        """Inline the local images in html if images are being inlined and
+        base is given."""
+        if self.images is None or base is None:
+            return html
+        if reset:
+            self.images.reset()
+        with timing.phase("images"):
+            return self.images.inline(html, base)
+
+    def convert_chunks(self, chunks, base=None):
+        """Convert a document given as an iterable of markdown chunks, as
+        made by gfm.split_blocks, yielding the HTML fragment for each chunk
+        which isn't empty.  Joined together, they are the HTML convert would
+        make of the whole document; the outline and title are set once the
+        last one has been converted.
+
+        Only one chunk is held in memory at a time.  Links can refer to
+        references defined further on, so the references are collected from
+        every chunk first, keeping the chunks in a temporary file between
+        the two passes."""
+        md = self.markdown
+        references = {}
+        count = 0
+        f = tempfile.TemporaryFile()
+        try:
+            for chunk in chunks:
+                text = gfm.gfm(chunk, self.fenced, self.transforms, self.cache, self.pool)
+                if text.strip():
+                    # run the preprocessors up to markdown's reference one
+                    with timing.phase("references"):
+                        md.reset()
+                        lines = text.split("\n")
+                        for processor in md.preprocessors:
+                            if processor is self.references_processor:
+                                break
+                            lines = processor.run(lines)
+                        references.update(md.references)
+                text = text.encode("utf-8")
+                f.write("%d\n" % len(text))
+                f.write(text)
+                count += 1
+            f.seek(0)
+            self.outline_processor.reset()
+            self.references_processor.references = references
+            stashed = None
+            # whitespace after a chunk is only kept if another chunk follows
+            space = u""
+            carried = u""
+            converted = False
+            marker = u"<p>%s</p>" % chunk_marker
+            for i in xrange(count):
+                text = carried + f.read(int(f.readline())).decode("utf-8")
+                last = i == count - 1
+                outline = self.outline_processor.outline
+                ids = self.outline_processor.ids
+                saved = (len(outline), set(ids))
+                with timing.phase("markdown"):
+                    md.reset()
+                    html = md.convert(text if last else text + u"\n\n" + chunk_marker)
+                if not last:
+                    end = html.rfind(marker)
+                    if end < 0:
+                        # the chunk ends in a block still open in markdown's
+                        # view, like raw html from a fence's code, so
+                        # convert it again along with the next chunk
+                        del outline[saved[0]:]
+                        ids.intersection_update(saved[1])
+                        carried = text
+                        continue
+                    html = html[:end]
+                carried = u""
+                if stashed is None:
+                    stashed = self.stashed_title()
+                html = self.inline_images(html, base, not converted)
+                converted = True
+                if html:
+                    yield space + html.rstrip()
+                    space = html[len(html.rstrip()):]
+            self.outline = self.outline_processor.outline
+            with timing.phase("title"):
+                self.title = self.find_title(stashed)
+        finally:
+            self.references_processor.references = {}
+            f.close()
+
+    def find_title(self, stashed=None):
+        """The text of the first h1 in the last document converted.  Headings
+        in raw html blocks are only looked at if there are no others; for a
+        document converted in chunks, stashed is the first of those."""
+        for heading in self.outline:
+            if heading['level'] == 1:
+                return heading['text']
+        if stashed is None:
+            stashed = self.stashed_title()
+        return stashed or ""
+
+    def stashed_title(self):
+        """The text of the first h1 in the raw html blocks of the last markdown
+        converted, or None."""
+        for html in self.markdown.htmlStash.rawHtmlBlocks:
+            match = isinstance(html, basestring) and h1_pattern.search(html)
+            if match:
+                return html_text(match.group(1)).strip()
+        return None
+
+    def page_context(self, document, header=None, footer=None, title="", outline=(), tokens=None):
+        """The template context for a page showing an HTML fragment.  The
+        title and outline are put in the context as title and toc.  tokens
+        are the tags, classes and ids used in the document, if it isn't the
+        fragment itself."""
+        context = dict(self.context)
+        context['title'] = title
+        context['toc'] = list(outline)
+        context['document'] = document
+        context['header'] = self.header if header is None else header
+        context['footer'] = self.footer if footer is None else footer
+        if self.shaker is not None:
+            context['embed'] = self.shaken_embed(context, tokens)
+        if self.mark_document:
+            context['document'] = document_start + document + document_end
+        return context
+
+    def shaken_embed(self, context, tokens=None):
+        """The embedded assets for a page, shaken down to what its document,
+        or tokens if given, and the rest of the page use."""
+        from redtape.embed import html_tokens
+        with timing.phase("shake"):
+            if tokens is None:
+                tokens = html_tokens(context['document'])
+            skeleton = dict(context, document=u"", embed={'css': [], 'js': []})
+            return self.shaker.embed(set(tokens) | html_tokens(self.template.render(skeleton)))
+
+    def page(self, document, header=None, footer=None, title="", outline=()):
+        """Render an HTML fragment as a full page with the template."""
+        return self.template.render(self.page_context(document, header, footer, title, outline))
+
+    def generate(self, document, header=None, footer=None, title="", outline=(), tokens=None):
+        """Render an HTML fragment as a full page with the template, yielding
+        it in chunks as it's rendered rather than building it in memory."""
+        context = self.page_context(document, header, footer, title, outline, tokens)
+        return self.template.generate(context)
+
+    def generate_file(self, document, header=None, footer=None, title="", outline=(), tokens=None):
+        """Like generate, for an HTML fragment read from the file object
+        document rather than held in memory."""
+        chunks = self.generate(document_marker, header, footer, title, outline, tokens)
+        return splice(chunks, document)
+
+    def render_chunks(self, chunks, header=None, footer=None, base=None):
+        """Render a document given as an iterable of markdown chunks as a
+        full page, returning an iterator over the page's chunks.  The
+        document is converted up front, into a temporary file, as the page
+        around it needs its title and outline."""
+        fragments = self.convert_chunks(chunks, base)
+        tokens = None
+        if self.shaker is not None:
+            from redtape.embed import scan_tokens
+            tokens = set()
+            fragments = scan_tokens(fragments, tokens)
+        document = spool(fragments)
+        return self.generate_file(document, header, footer, self.title, self.outline, tokens)
+
+    def render(self, text, header=None, footer=None, base=None):
+        """Render markdown text as a full page, with this renderer's header
+        and footer unless others are given."""
+        document = self.convert(text, base)
+        return self.page(document, header, footer, self.title, self.outline)
+
+    def render_many(self, texts):
+        """Render each markdown text in an iterable, yielding the pages as
+        they are rendered."""
+        for text in texts:
+            yield self.render(text)
@@ -10,19 +10,21 @@ It is not meant for complex documentation generation, but as an easy
 way to flexibly create one-off documents or collections of documents while
 retaining control over document style."""
 
-import pygments
-import jinja2
-try:
-    from lxml.html import document_fromstring
-    from lxml.cssselect import CSSSelector as cs
-    has_lxml = True
-except:
-    has_lxml = False
-
 import os
+import codecs
+import signal
+import time
+import hashlib
+import posixpath
 import redtape
-from glob import glob
-from redtape import gfm
+from contextlib import contextmanager
+from itertools import chain
+from redtape import gfm, lexers, timing
+from redtape.discovery import walk
+from redtape.cache import HighlightCache, default_cache_dir
+from redtape.manifest import Manifest, file_hash, manifest_name, text_hash
+from redtape.publish import fingerprint_assets, gzip_files, publish_assets
+from redtape.renderer import Renderer, asset_context, asset_path, load_template, spool
 from optparse import OptionParser
 
 parser = OptionParser(version=".".join(map(str, redtape.VERSION)),
@@ -31,49 +33,110 @@ parser.add_option("-t", "--template", help="use alternate document template")
 parser.add_option("-e", "--embed", action="store_true", help="embed all css/js in each output file")
 parser.add_option("-o", "--destination", help="write HTML/assets to a separate destination directory")
 parser.add_option("-r", "--recursive", action="store_true", help="recurse into subdirectories")
+parser.add_option("", "--ext", action="append",
+        help="render files with this extension, may be repeated (default .md, .mdown and .markdown)")
+parser.add_option("", "--exclude", action="append",
+        help="skip files and directories matching this gitignore-style pattern, may be repeated")
+parser.add_option("", "--no-shake", action="store_true",
+        help="embed all of the css and js with --embed, not just what each page uses")
+parser.add_option("", "--inline-images", type="int", default=64*1024,
+        help="with --embed, inline local images up to this many bytes as data URIs, 0 to keep them linked (default %default)")
 parser.add_option("", "--use-js", action="store_true", help="link in jquery & bootstrap js files")
 parser.add_option("", "--create-assets", action="store_true", help="create/update directory ./assets with rt assets")
+parser.add_option("", "--fingerprint", action="store_true",
+        help="publish just the assets pages link to assets/, under content-hashed names")
+parser.add_option("", "--search", action="store_true",
+        help="write a search index of the pages to search/, for the bundled search.js")
+parser.add_option("", "--gzip", action="store_true", help="write a gzipped .gz copy of every page and published asset")
 parser.add_option("", "--prettify", action="store_true", help="use google prettify for code blocks instead of pygments")
+parser.add_option("", "--max-size", type="int", help="documents larger than this many bytes are over budget")
+parser.add_option("", "--timeout", type="float", help="documents taking longer than this many seconds to render are over budget")
+parser.add_option("", "--over-budget", type="choice", choices=["skip", "escape"], default="skip",
+        help="skip documents which are over budget, or render them as escaped plain text (skip|escape)")
+parser.add_option("", "--default-language", help="highlight untagged code blocks as this language when it can't be sniffed")
+parser.add_option("", "--guess-lines", type="int", default=lexers.guess_lines,
+        help="number of lines of an untagged code block to guess its language from (default %default)")
+parser.add_option("", "--stream-size", type="int", default=16*1024*1024,
+        help="render documents larger than this many bytes a chunk at a time, to bound memory use (default %default)")
+parser.add_option("-w", "--watch", action="store_true", help="keep running, re-rendering documents as they change")
+parser.add_option("", "--interval", type="float", default=1.0, help="seconds between checks for changes in --watch mode (default %default)")
+parser.add_option("", "--serve", action="store_true", help="serve rendered documents from the first directory over HTTP")
+parser.add_option("", "--host", default="127.0.0.1",
+        help="address for --serve to listen on, 0.0.0.0 for every interface (default %default)")
+parser.add_option("", "--port", type="int", default=8000, help="port for --serve (default %default)")
+parser.add_option("", "--serve-cache", type="int", default=256, help="number of rendered pages --serve keeps in memory (default %default)")
+parser.add_option("-j", "--jobs", type="int", default=1, help="render documents with this many processes")
+parser.add_option("", "--highlight-jobs", type="int", default=1,
+        help="highlight the code blocks in each document with this many processes")
+parser.add_option("", "--profile", action="store_true",
+        help="time each phase of rendering every document, and summarize where the time went")
+parser.add_option("", "--profile-report", default="rt-profile.json",
+        help="json file for the --profile report of each document and the totals (default %default)")
+parser.add_option("", "--profile-top", type="int", default=10,
+        help="number of slowest documents --profile lists (default %default)")
+parser.add_option("", "--cprofile", metavar="DOCUMENT",
+        help="render DOCUMENT under cProfile, writing its stats to a .prof file in the current directory")
+parser.add_option("-f", "--force", action="store_true", help="rebuild all documents, even unchanged ones")
+parser.add_option("", "--cache-dir", help="directory for the highlighted code cache (default ~/.cache/redtape)")
+parser.add_option("", "--no-cache", action="store_true", help="don't cache highlighted code blocks")
 
-pkg_dir = os.path.dirname(__file__)
-asset_path = os.path.join(os.path.dirname(__file__), "assets")
+class BudgetExceeded(Exception):
+    pass
 
-def extract_title(fragment):
-    if not has_lxml: return ""
-    doc = document_fromstring(fragment)
+@contextmanager
+def time_budget(seconds):
+    """Raise BudgetExceeded in the body of this context if it runs for more
+    than seconds.  This relies on SIGALRM, which Python only handles between
+    bytecodes, so it can't interrupt a single long-running regex."""
+    if not seconds:
+        yield
+        return
+    def expired(signum, frame):
+        raise BudgetExceeded("rendering took longer than %ss" % seconds)
+    previous = signal.signal(signal.SIGALRM, expired)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
     try:
-        return cs('h1')(doc)[0].text_content()
-    except:
-        import traceback
-        traceback.print_exc()
-        return ""
-
-def markdown_files(directory):
-    paths = []
-    for ext in (".md", ".mdown", ".markdown"):
-        paths += glob(os.path.join(directory, "*%s" % ext))
-    return paths
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def render_markdown(text, opts, convert=gfm.gfmd):
+    """Render markdown text to an HTML fragment with convert, within the size
+    and time budget given in opts.  Raises BudgetExceeded if it is over
+    budget."""
+    if opts.max_size and len(text.encode("utf-8")) > opts.max_size:
+        raise BudgetExceeded("document is larger than %d bytes" % opts.max_size)
+    with time_budget(opts.timeout):
+        return convert(text)
 
-def arg_to_paths(arg, recursive=False):
-    paths = []
+def markdown_files(directory, extensions=None):
+    return list(walk(directory, False, extensions))
+
+def arg_to_paths(arg, recursive=False, extensions=None, excludes=None):
+    """The documents to render for a command line argument: the file itself,
+    or the documents in a directory which aren't excluded."""
     if not os.path.exists(arg):
         raise Exception("File not found: %s" % arg)
     if os.path.isfile(arg):
-        paths.append(arg)
-    if os.path.isdir(arg):
-        if recursive:
-            for path, dirs, filenames in os.walk(arg):
-                paths += markdown_files(path)
-        else:
-            paths += markdown_files(arg)
-    return paths
+        return [arg]
+    return list(walk(arg, recursive, extensions, excludes))
+
+def output_path(path, arg, destination=None):
+    """The HTML file that a document found in arg is rendered to: the one
+    next to it, or the one at the same place relative to arg in destination."""
+    output = path.rsplit('.', 1)[0] + '.html'
+    if not destination:
+        return output
+    base = arg if os.path.isdir(arg) else os.path.dirname(arg)
+    return os.path.join(destination, os.path.relpath(output, base or os.curdir))
 
-def create_assets():
+def create_assets(directory=None):
     import shutil
-    current = os.path.abspath(os.curdir)
+    current = os.path.abspath(directory or os.curdir)
     destination = os.path.join(current, "assets")
     if os.path.exists(destination) and not os.path.isdir(destination):
-        raise Exception("The path ./assets exists and is a file.")
+        raise Exception("The path %s exists and is a file." % destination)
     shutil.copytree(asset_path, destination)
 
 def find_customizations(path):
@@ -102,75 +165,374 @@ def find_custom_template(args):
 def get_jinja_template(opts, args):
     """Get a jinja template suitable for rendering our documents.  Care is
     taken to chose figure out which template to render, and to allow custom
-    templates to inherit from the default one."""
-    template_paths = [asset_path]
-    template = "basic.jinja"
-    if opts.template:
-        extra, template = os.path.split(os.path.abspath(opts.template))
-        template_paths.append(extra)
+    templates to inherit from the default one.  Compiled templates are cached
+    with the highlighted code, unless caching is off."""
+    cache_dir = None
+    if not opts.no_cache:
+        cache_dir = os.path.join(opts.cache_dir or default_cache_dir(), "templates")
+    return load_template(opts.template or find_custom_template(args), cache_dir)
+
+def template_files(opts, args):
+    """The template files which documents rendered with opts depend on."""
+    paths = [os.path.join(asset_path, "basic.jinja")]
+    custom = os.path.abspath(opts.template) if opts.template else find_custom_template(args)
+    if custom:
+        paths.append(custom)
+    return paths
+
+def build_inputs(opts, args):
+    """The hashes of the inputs shared by every document in this build: the
+    templates, and the options which change the rendered output."""
+    options = dict((name, getattr(opts, name)) for name in ("embed", "use_js",
+        "prettify", "default_language", "guess_lines", "max_size", "timeout",
+        "over_budget", "fingerprint", "gzip", "no_shake", "inline_images", "search"))
+    options["version"] = redtape.VERSION
+    return {
+        "template": text_hash("".join(file_hash(p) or "" for p in template_files(opts, args))),
+        "options": text_hash(repr(sorted(options.items()))),
+    }
+
+def linked_assets(opts):
+    """The css and js assets that pages rendered with opts link to, or None
+    if they embed them instead."""
+    if opts.embed:
+        return None
+    context = asset_context(opts.prettify, False, opts.use_js)
+    return context['css'] + context['js']
+
+# The options and Renderer used by render_page, set up once per process.
+renderer = {}
+
+def setup_renderer(opts, args, highlight_jobs=1):
+    """Set up this process to render documents with opts: load the template,
+    and open the highlight cache and pool."""
+    lexers.default_language = opts.default_language
+    lexers.guess_lines = opts.guess_lines
+    cache = pool = None
+    if not opts.no_cache and not opts.prettify:
+        cache = HighlightCache(opts.cache_dir)
+    if highlight_jobs > 1 and not opts.prettify:
+        from multiprocessing import Pool
+        pool = Pool(highlight_jobs)
+    rt = Renderer(fenced="pygments" if not opts.prettify else "bootstrap",
+        template=get_jinja_template(opts, args), embed=opts.embed, use_js=opts.use_js,
+        cache=cache, pool=pool, shake=not opts.no_shake, inline_images=opts.inline_images,
+        mark_document=opts.search)
+    renderer.clear()
+    if opts.fingerprint and not opts.embed:
+        published = fingerprint_assets(linked_assets(opts))
+        renderer['assets'] = dict((kind, [published[asset][0] for asset in rt.context[kind]])
+            for kind in ('css', 'js'))
+    renderer['opts'] = opts
+    renderer['renderer'] = rt
+
+def asset_links(output):
+    """The links to the fingerprinted css and js for the page at output.
+    They're published to assets/ in the destination (or current) directory,
+    so they're linked relative to how deep the page is below it."""
+    opts, assets = renderer['opts'], renderer['assets']
+    root = os.path.relpath(opts.destination or os.curdir, os.path.dirname(output) or os.curdir)
+    if root == os.curdir:
+        return assets
+    prefix = "/".join(root.split(os.sep))
+    return dict((kind, [posixpath.join(prefix, name) for name in names])
+        for kind, names in assets.items())
+
+def setup_worker(opts, args):
+    """Set up a --jobs worker process like setup_renderer.  An error is kept
+    to be reported for each document rather than raised, as a pool replaces
+    workers which fail to start over and over again."""
+    try:
+        setup_renderer(opts, args)
+    except Exception, e:
+        renderer.clear()
+        renderer['error'] = e
+
+def render_page(text, header="", footer="", escaped=False, base=None):
+    """Render markdown text as a full page with the template, header and
+    footer, returning an iterator over the page's unicode chunks.  If escaped
+    is True the text is shown as plain text instead.  base is the directory
+    the document's images are relative to.  Raises BudgetExceeded for
+    documents over budget."""
+    opts, rt = renderer['opts'], renderer['renderer']
+    if escaped:
+        from cgi import escape
+        return rt.generate("<pre>%s</pre>" % escape(text), header, footer)
+    document = render_markdown(text, opts, lambda text: rt.convert(text, base))
+    return rt.generate(document, header, footer, rt.title, rt.outline)
+
+def render_file(path, header="", footer="", escaped=False, base=None):
+    """Render the markdown file at path like render_page, a chunk at a time,
+    for documents too large to be held in memory as a whole."""
+    opts, rt = renderer['opts'], renderer['renderer']
+    with open(path) as f:
+        lines = codecs.iterdecode(f, "utf-8")
+        if escaped:
+            from cgi import escape
+            document = spool(chain([u"<pre>"], (escape(l) for l in lines), [u"</pre>"]))
+            return rt.generate_file(document, header, footer, tokens=["pre"])
+        if opts.max_size and os.path.getsize(path) > opts.max_size:
+            raise BudgetExceeded("document is larger than %d bytes" % opts.max_size)
+        with time_budget(opts.timeout):
+            return rt.render_chunks(gfm.split_blocks(lines), header, footer, base)
+
+def write_stream(chunks, path, encoding="utf-8", buffer_size=64*1024):
+    """Write an iterable of unicode chunks to path as they are produced,
+    encoding them incrementally into a buffered file.  Large chunks, like
+    the document itself, are encoded a piece at a time.  The directory path
+    is in is created if it doesn't exist.
+
+    The chunks go to a temporary file next to path which is renamed over it
+    once complete, so path is never left half written.  If path already has
+    the same content it's left alone, mtime and all, and False is returned;
+    otherwise True is."""
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # another process may have just made it
+            if not os.path.isdir(directory):
+                raise
+    encoder = codecs.getincrementalencoder(encoding)()
+    digest = hashlib.sha1()
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(tmp, "wb", buffer_size) as f:
+            for chunk in timing.timed(chunks, "template"):
+                with timing.phase("write"):
+                    for i in xrange(0, len(chunk), buffer_size):
+                        data = encoder.encode(chunk[i:i+buffer_size])
+                        digest.update(data)
+                        f.write(data)
+            with timing.phase("write"):
+                data = encoder.encode(u"", True)
+                digest.update(data)
+                f.write(data)
+                size = f.tell()
+        with timing.phase("write"):
+            if (os.path.isfile(path) and os.path.getsize(path) == size
+                    and file_hash(path) == digest.hexdigest()):
+                os.remove(tmp)
+                return False
+            os.rename(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return True
+
+def render_document(job):
+    """Render a document and write it to its output, where job is a tuple of
+    (path, output, source, header, footer).  A source of None means that
+    the document is read from path as it's rendered, a chunk at a time if
+    it's larger than --stream-size.  Returns a tuple of (created, messages, cache hits,
+    cache misses, images, image counts, profile), where images maps the
+    images inlined in the page to their hashes, and profile is the document's
+    timing report with --profile, or None.  Errors are returned as messages
+    rather than raised, so that one bad document can't break a build."""
+    path, output, source = job[:3]
+    if 'error' in renderer:
+        return False, ["Error rendering %s: %s" % (path, renderer['error'])], 0, 0, {}, [], None
+    opts = renderer['opts']
+    profiler = None
+    if opts.cprofile and os.path.abspath(path) == os.path.abspath(opts.cprofile):
+        import cProfile
+        profiler = cProfile.Profile()
+    if opts.profile:
+        timing.start()
+    start = time.time()
+    if profiler is not None:
+        result = profiler.runcall(build_document, job)
+        stats = os.path.splitext(os.path.basename(path))[0] + ".prof"
+        profiler.dump_stats(stats)
+        result[1].append("Wrote cProfile stats for %s to %s" % (path, stats))
     else:
-        template = find_custom_template(args) or template
+        result = build_document(job)
+    report = None
+    if opts.profile:
+        report = timing.stop().report()
+        report.update(path=path, output=output, total=time.time() - start)
+        report["counts"]["bytes in"] = len(source) if source is not None else os.path.getsize(path)
+        if result[0]:
+            report["counts"]["bytes out"] = os.path.getsize(output)
+    return result + (report,)
+
+def build_document(job):
+    """Render and write a document for render_document, returning all but
+    the profile in its result."""
+    path, output, source, header, footer = job
+    opts, cache = renderer['opts'], renderer['renderer'].cache
+    images = renderer['renderer'].images
+    hits, misses = (cache.hits, cache.misses) if cache else (0, 0)
+    counts = list(images.counts) if images else []
+    base = os.path.dirname(path) or os.curdir
+    if 'assets' in renderer:
+        renderer['renderer'].context.update(asset_links(output))
+    messages = []
+    try:
+        if source is None and opts.stream_size and os.path.getsize(path) > opts.stream_size:
+            text, render = path, render_file
+        else:
+            if source is None:
+                with timing.phase("read"):
+                    with open(path) as f:
+                        source = f.read()
+            text, render = source.decode("utf-8"), render_page
+        try:
+            page = render(text, header, footer, base=base)
+        except BudgetExceeded, e:
+            if opts.over_budget == "skip":
+                return False, ["Skipped %s: %s" % (path, e)], 0, 0, {}, []
+            messages.append("Escaped %s: %s" % (path, e))
+            page = render(text, header, footer, escaped=True)
+        if write_stream(page, output):
+            messages.append("Created %s from %s" % (output, path))
+        else:
+            messages.append("Unchanged %s from %s" % (output, path))
+        created = True
+    except Exception, e:
+        messages.append("Error rendering %s: %s" % (path, e))
+        created = False
+    if cache:
+        hits, misses = cache.hits - hits, cache.misses - misses
+    if images:
+        counts = [now - then for now, then in zip(images.counts, counts)]
+        return created, messages, hits, misses, dict(images.used), counts
+    return created, messages, hits, misses, {}, counts
 
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_paths))
-    return env.get_template(template)
+def document_job(path, header, footer, shared, output=None):
+    """Return the job to render the document at path to output (by default,
+    the HTML file next to it) and the hashes of its inputs for the manifest.
+    The document is hashed a block at a time, and only read when the job is
+    rendered, so a build never holds more than the documents being rendered
+    in memory."""
+    output = output or path.rsplit('.', 1)[0] + '.html'
+    inputs = dict(shared, source=file_hash(path), header=text_hash(header),
+        footer=text_hash(footer))
+    return (path, output, None, header, footer), inputs
 
 def main():
     opts, args = parser.parse_args()
 
     if opts.create_assets:
-        create_assets()
+        create_assets(opts.destination)
         return 0
 
+    if opts.serve:
+        from redtape.server import serve
+        return serve(opts, args or ["."])
+
     if not args:
         parser.print_usage()
         return -1
 
-
-    context = {}
-    use_prettify = context['prettify'] = opts.prettify
-
-    css = [
-        "assets/css/bootstrap.min.css",
-        "assets/css/%s" % ("prettify.css" if use_prettify else "pygments.css"),
-    ]
-    js = [] if not opts.use_js else [
-        "assets/js/jquery.min.js",
-        "assets/js/bootstrap.min.js",
-    ]
-
-    if use_prettify: # if prettifying, link prettify no matter what
-        js.append("assets/js/prettify.js")
-
-    context['js'] = js
-    context['css'] = css
-
-    if opts.embed:
-        embed = {'css':[], 'js':[]}
-        for csf in css:
-            with open(os.path.join(pkg_dir, csf)) as f:
-                embed['css'].append(f.read().decode("utf-8"))
-        for jsf in js:
-            with open(os.path.join(pkg_dir, jsf)) as f:
-                embed['js'].append(f.read().decode("utf-8"))
-        context['embed'] = embed
-    else:
-        context['embed'] = None
-
+    start = time.time()
+    manifest = Manifest(os.path.join(opts.destination or "", manifest_name))
+    shared = build_inputs(opts, args)
+    jobs, inputs, documents = [], [], []
+    hashes = {}
     for arg in args:
         header, footer = "", ""
-        paths = arg_to_paths(arg, opts.recursive)
+        paths = arg_to_paths(arg, opts.recursive, opts.ext, opts.exclude)
         if os.path.isdir(arg):
             header, footer = find_customizations(arg)
         for path in paths:
-            output = path.rsplit('.', 1)[0] + '.html'
-            with open(path) as f:
-                document = gfm.gfmd(f.read().decode("utf-8"), fenced="pygments" if not opts.prettify else "bootstrap")
-            context['title'] = extract_title(document)
-            context['document'] = document
-            context['header'] = header
-            context['footer'] = footer
-            template = get_jinja_template(opts, args)
-            with open(output, "w") as f:
-                f.write(template.render(context).encode("utf-8"))
-                print "Created %s from %s" % (output, path)
+            output = output_path(path, arg, opts.destination)
+            documents.append((path, output))
+            hash_start = time.time()
+            job, doc_inputs = document_job(path, header, footer, shared, output)
+            hashes[path] = time.time() - hash_start
+            if opts.embed and opts.inline_images:
+                doc_inputs["images"] = manifest.dependencies(output, "images")
+            profiled = opts.cprofile and os.path.abspath(path) == os.path.abspath(opts.cprofile)
+            if not opts.force and not profiled and manifest.is_fresh(job[1], doc_inputs):
+                manifest.skipped += 1
+                continue
+            jobs.append(job)
+            inputs.append(doc_inputs)
+
+    pool = None
+    if opts.jobs > 1 and len(jobs) > 1:
+        from multiprocessing import Pool
+        # set up here first too, so a bad template stops the build with its
+        # error instead of failing in every worker
+        setup_renderer(opts, args)
+        pool = Pool(opts.jobs, setup_worker, (opts, args))
+        results = pool.imap(render_document, jobs)
+    elif jobs:
+        setup_renderer(opts, args, opts.highlight_jobs)
+        results = (render_document(job) for job in jobs)
+    else:
+        # nothing to render, so don't pay for loading markdown and jinja2
+        results = []
+
+    cache = None if opts.no_cache or opts.prettify else HighlightCache(opts.cache_dir)
+    images = None
+    if opts.embed and opts.inline_images:
+        from redtape.embed import ImageInliner
+        images = ImageInliner(opts.inline_images)
+    errors = 0
+    outputs = []
+    profiles = []
+    for job, doc_inputs, result in zip(jobs, inputs, results):
+        created, messages, hits, misses, used, counts, profile = result
+        if profile is not None:
+            profile["phases"]["hash"] = hashes[job[0]]
+            profile["total"] += hashes[job[0]]
+            profile["counts"].update({"cache hits": hits, "cache misses": misses})
+            profiles.append(profile)
+        for message in messages:
+            print message
+        if created:
+            if images is not None:
+                doc_inputs["images"] = used
+            manifest.update(job[1], doc_inputs)
+            manifest.rebuilt += 1
+            if messages[-1].startswith("Unchanged"):
+                manifest.unchanged += 1
+                if opts.gzip and not os.path.exists(job[1] + ".gz"):
+                    outputs.append(job[1])
+            else:
+                manifest.written += 1
+                outputs.append(job[1])
+        elif messages[-1].startswith("Error"):
+            errors += 1
+        if cache is not None:
+            cache.hits += hits
+            cache.misses += misses
+        if images is not None and counts:
+            images.counts = [total + n for total, n in zip(images.counts, counts)]
 
+    for p in (pool, renderer['renderer'].pool if renderer else None):
+        if p is not None:
+            p.close()
+    if opts.profile:
+        timing.write_report(opts.profile_report, profiles, time.time() - start)
+        print timing.summary(profiles, opts.profile_top)
+        print "Wrote the profile of each document to %s" % opts.profile_report
+    if opts.fingerprint and not opts.embed:
+        directory = opts.destination or os.curdir
+        assets = publish_assets(fingerprint_assets(linked_assets(opts)), directory)
+        print "Published %d assets to %s" % (len(assets), os.path.join(directory, "assets"))
+        if opts.gzip:
+            outputs += [path for path in assets if not os.path.exists(path + ".gz")]
+    if opts.search:
+        from redtape.search import SearchIndex
+        index = SearchIndex(opts.destination or os.curdir)
+        written = index.update(documents)
+        print index.report()
+        if opts.gzip:
+            outputs += written
+    if opts.gzip and outputs:
+        gzip_files(outputs, opts.jobs if opts.jobs > 1 else None)
+    manifest.save()
+    print manifest.report()
+    if cache is not None:
+        print cache.report()
+    if images is not None:
+        print images.report()
+    if opts.watch:
+        from redtape.watch import watch
+        return watch(opts, args, manifest)
+    return 1 if errors else 0
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A client-side search index for rendered documents.
+
+With ``--search``, rt writes an inverted index of the documents in the pages
+it builds to ``search/`` in the destination (or current) directory, for
+``search.js`` to query from the browser without any search service:
+
+    search/docs.json    the pages: [{"url", "title", "headings": [[id, text]]}]
+    search/ab.json      the terms starting with "ab", each mapped to a list
+                        of page ids and heading indexes: [page, heading, ...]
+
+A page's id is its index in docs.json, and a heading of -1 is the top of the
+page.  Shards are named after the first two characters of their terms, or
+the hex of those characters' utf-8 when they aren't ascii letters or
+digits, so a query only fetches the shards for its own terms.
+
+The index is kept up to date incrementally.  Its state file,
+``search/.state.json``, records the id, mtime and shards of every indexed page, so
+only pages whose output changed are tokenized again, and only the shards
+their old and new terms are in are rewritten."""
+
+import os
+import re
+import json
+import shutil
+from HTMLParser import HTMLParser
+
+from redtape.renderer import document_end, document_start, pkg_dir
+
+state_name = ".state.json"
+script_path = os.path.join(pkg_dir, "assets", "js", "search.js")
+
+term_pattern = re.compile(r'[^\W_]+', re.UNICODE)
+ascii_prefix_pattern = re.compile(r'^[a-z0-9]+$')
+skipped_pattern = re.compile(r'<(script|style)\b[^>]*>', re.IGNORECASE)
+heading_pattern = re.compile(r'<h[1-6][^>]*?\sid="([^"]*)"[^>]*>(.*?)</h[1-6]>', re.IGNORECASE)
+title_pattern = re.compile(r'<title>(.*?)</title>', re.IGNORECASE|re.DOTALL)
+tag_pattern = re.compile(r'<[^>]*>')
+
+max_term_length = 32
+# the longest tag that's joined up when it spans lines
+max_tag_length = 4096
+
+def shard_name(term):
+    """The name of the shard holding term."""
+    prefix = term[:2]
+    if ascii_prefix_pattern.match(prefix):
+        return prefix
+    return prefix.encode("utf-8").encode("hex")
+
+def terms(text):
+    """The terms to index in a piece of text: its words, lowercased, leaving
+    out single characters and numbers."""
+    for term in term_pattern.findall(text.lower()):
+        if 1 < len(term) <= max_term_length and not term.isdigit():
+            yield term
+
+def page_lines(f):
+    """Yield the lines of the document in the html page being read from f,
+    which rt marks with comments around it when building with --search,
+    leaving out the template, header and footer around it, and scripts and
+    styles in it.  Tags which span lines are joined onto one."""
+    carry, skipping, in_document = u"", None, False
+    for line in f:
+        line = carry + line.decode("utf-8", "replace")
+        cut = line.rfind(u"<")
+        carry = u""
+        if cut > line.rfind(u">") and len(line) - cut < max_tag_length:
+            carry, line = line[cut:], line[:cut]
+        if not in_document:
+            start = line.find(document_start)
+            if start < 0:
+                continue
+            line, in_document = line[start + len(document_start):], True
+        end = line.find(document_end)
+        if end >= 0:
+            line, carry = line[:end], None
+        text = []
+        while line:
+            if skipping:
+                end = re.search(r'</%s\s*>' % skipping, line, re.IGNORECASE)
+                if not end:
+                    break
+                line, skipping = line[end.end():], None
+            else:
+                start = skipped_pattern.search(line)
+                if not start:
+                    text.append(line)
+                    break
+                text.append(line[:start.start()])
+                line, skipping = line[start.end():], start.group(1).lower()
+        yield u"".join(text)
+        if carry is None:
+            return
+
+def index_page(path):
+    """Tokenize the html page at path, returning its title, its headings as
+    a list of [id, text], and a dict mapping each of its terms to the sorted
+    indexes of the headings it appears under, -1 being the top of the page."""
+    parser = HTMLParser()
+    title, headings, postings = u"", [], {}
+    def add(html, heading):
+        for term in terms(parser.unescape(tag_pattern.sub(u" ", html))):
+            postings.setdefault(term, set()).add(heading)
+    heading = -1
+    with open(path) as f:
+        match = title_pattern.search(f.read(64*1024).decode("utf-8", "replace"))
+        if match:
+            title = parser.unescape(match.group(1)).strip()
+        f.seek(0)
+        for line in page_lines(f):
+            pos = 0
+            for match in heading_pattern.finditer(line):
+                add(line[pos:match.start()], heading)
+                text = parser.unescape(tag_pattern.sub(u"", match.group(2))).strip()
+                headings.append([match.group(1), text])
+                heading = len(headings) - 1
+                add(match.group(2), heading)
+                pos = match.end()
+            add(line[pos:], heading)
+    return title, headings, dict((term, sorted(found)) for term, found in postings.iteritems())
+
+def write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, separators=(",", ":"), sort_keys=True)
+    os.rename(tmp, path)
+
+class SearchIndex(object):
+    """The search index in directory/search for pages under directory, with
+    its state kept at state_path, by default in the index directory."""
+    def __init__(self, directory, state_path=None):
+        self.root = directory
+        self.directory = os.path.join(directory, "search")
+        self.state_path = state_path or os.path.join(self.directory, state_name)
+        self.docs = []
+        try:
+            with open(self.state_path) as f:
+                self.docs = json.load(f).get("docs", [])
+        except (IOError, ValueError):
+            pass
+        if not os.path.isfile(os.path.join(self.directory, "docs.json")):
+            # the index is gone, so the state describes nothing
+            self.docs = []
+        self.ids = dict((doc["output"], i) for i, doc in enumerate(self.docs) if doc)
+        self.changed = set()
+        self.postings = {}
+        self.dirty = set()
+        # without state, the ids in any shards left behind mean nothing
+        self.stale = set()
+        if not self.ids and os.path.isdir(self.directory):
+            self.stale = set(name[:-5] for name in os.listdir(self.directory)
+                if name.endswith(".json") and name != "docs.json" and not name.startswith("."))
+            self.dirty.update(self.stale)
+        self.reindexed = 0
+        self.removed = 0
+
+    def remove(self, i):
+        self.dirty.update(self.docs[i]["shards"])
+        self.changed.add(i)
+        del self.ids[self.docs[i]["output"]]
+        self.docs[i] = None
+
+    def add(self, source, output):
+        """Index the page at output, rendered from source, if it's new or has
+        changed since it was last indexed."""
+        stat = os.stat(output)
+        i = self.ids.get(output)
+        if i is not None and self.docs[i]["stat"] == [stat.st_mtime, stat.st_size]:
+            return
+        title, headings, postings = index_page(output)
+        if i is None:
+            i = self.docs.index(None) if None in self.docs else len(self.docs)
+            if i == len(self.docs):
+                self.docs.append(None)
+            self.ids[output] = i
+        else:
+            self.dirty.update(self.docs[i]["shards"])
+        shards = set(shard_name(term) for term in postings)
+        self.dirty.update(shards)
+        self.changed.add(i)
+        self.postings[i] = postings
+        self.docs[i] = {
+            "source": source,
+            "output": output,
+            "stat": [stat.st_mtime, stat.st_size],
+            "shards": sorted(shards),
+            "url": os.path.relpath(output, self.root).replace(os.sep, "/"),
+            "title": title,
+            "headings": headings,
+        }
+        self.reindexed += 1
+
+    def update(self, documents):
+        """Bring the index up to date with documents, a list of (source,
+        output) pairs, and drop the pages whose source or output is gone.
+        Returns the paths of the index files written."""
+        for source, output in documents:
+            if os.path.isfile(output):
+                self.add(source, output)
+        for i, doc in enumerate(self.docs):
+            if doc and not (os.path.exists(doc["source"]) and os.path.exists(doc["output"])):
+                self.remove(i)
+                self.removed += 1
+        return self.save()
+
+    def save(self):
+        """Rewrite the shards with changed postings, the page list and the
+        state, returning the paths of the index files written."""
+        written = []
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        added = {}
+        for i, postings in sorted(self.postings.iteritems()):
+            for term, headings in postings.iteritems():
+                shard = added.setdefault(shard_name(term), {})
+                shard.setdefault(term, []).extend(n for heading in headings for n in (i, heading))
+        for name in sorted(self.dirty):
+            path = os.path.join(self.directory, name + ".json")
+            shard = {}
+            if os.path.isfile(path) and name not in self.stale:
+                with open(path) as f:
+                    shard = json.load(f)
+            for term in shard.keys():
+                postings = shard[term]
+                kept = [n for pair in zip(postings[::2], postings[1::2])
+                    if pair[0] not in self.changed for n in pair]
+                if kept:
+                    shard[term] = kept
+                else:
+                    del shard[term]
+            for term, postings in added.get(name, {}).iteritems():
+                shard.setdefault(term, []).extend(postings)
+            if shard:
+                write_json(path, shard)
+                written.append(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        path = os.path.join(self.directory, "docs.json")
+        if self.changed or not os.path.isfile(path):
+            fields = ("url", "title", "headings")
+            write_json(path, [doc and dict((k, doc[k]) for k in fields) for doc in self.docs])
+            written.append(path)
+        path = os.path.join(self.directory, "search.js")
+        if not os.path.isfile(path) or open(path).read() != open(script_path).read():
+            shutil.copyfile(script_path, path)
+            written.append(path)
+        write_json(self.state_path, {"docs": self.docs})
+        self.dirty, self.changed, self.postings, self.stale = set(), set(), {}, set()
+        return written
+
+    def report(self):
+        return "Search index: reindexed %d pages, removed %d, %d pages indexed" % (
+            self.reindexed, self.removed, len(self.ids))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A local HTTP render service for redtape.
+
+``rt --serve <dir>`` renders the markdown documents in dir on request with
+the same pipeline and template that rt uses for files, from a process which
+keeps everything loaded.  Rendered pages are kept in a bounded LRU keyed by
+the hash of their inputs, which doubles as their ETag so that conditional
+requests can be answered with a 304 without rendering anything.  It only
+listens on localhost unless --host says otherwise.
+
+    GET /path/doc.html      render path/doc.md (or .mdown, .markdown, or --ext)
+    POST /render            render the markdown in the request body
+    GET /_stats             cache and latency counters as JSON
+"""
+
+import os
+import json
+import time
+from collections import OrderedDict
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from redtape import script
+from redtape.discovery import default_extensions
+from redtape.manifest import text_hash
+
+class LRUCache(object):
+    """A dictionary-like cache holding at most size items, which evicts the
+    least recently used item when it is full."""
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.items[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+        while len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+class Stats(object):
+    """Request and render latency counters."""
+    def __init__(self):
+        self.requests = 0
+        self.renders = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed):
+        self.requests += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def report(self, cache):
+        mean = self.total_time / self.requests if self.requests else 0.0
+        return {
+            "requests": self.requests,
+            "renders": self.renders,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            "cache": {"hits": cache.hits, "misses": cache.misses,
+                "size": len(cache), "capacity": cache.size},
+            "latency_ms": {"mean": mean * 1000, "max": self.max_time * 1000},
+        }
+
+class RenderHandler(BaseHTTPRequestHandler):
+    server_version = "redtape"
+
+    def do_GET(self):
+        start = time.time()
+        try:
+            path = self.path.split("?", 1)[0]
+            if path == "/_stats":
+                return self.respond(200, json.dumps(self.server.stats.report(self.server.pages)),
+                    "application/json")
+            source_path = self.server.find_source(path)
+            if source_path is None:
+                return self.respond(404, "Not found\n", "text/plain")
+            with open(source_path) as f:
+                self.render(f.read())
+        finally:
+            self.server.stats.record(time.time() - start)
+
+    def do_POST(self):
+        start = time.time()
+        try:
+            if self.path.split("?", 1)[0] != "/render":
+                return self.respond(404, "Not found\n", "text/plain")
+            length = int(self.headers.get("Content-Length") or 0)
+            self.render(self.rfile.read(length))
+        finally:
+            self.server.stats.record(time.time() - start)
+
+    def render(self, source):
+        server = self.server
+        etag = '"%s"' % text_hash(source + server.inputs)
+        if etag in [tag.strip() for tag in (self.headers.get("If-None-Match") or "").split(",")]:
+            server.stats.not_modified += 1
+            return self.respond(304, None, headers={"ETag": etag})
+        page = server.pages.get(etag)
+        if page is None:
+            try:
+                page = u"".join(script.render_page(source.decode("utf-8"), server.header, server.footer))
+            except Exception, e:
+                server.stats.errors += 1
+                return self.respond(500, "Error rendering document: %s\n" % e, "text/plain")
+            page = page.encode("utf-8")
+            server.stats.renders += 1
+            server.pages.set(etag, page)
+        self.respond(200, page, "text/html; charset=utf-8", {"ETag": etag})
+
+    def respond(self, status, body, content_type=None, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+class RenderServer(HTTPServer):
+    """An HTTPServer which renders the markdown documents in root.  It serves
+    one request at a time, as the render state isn't thread safe."""
+    def __init__(self, address, opts, root):
+        HTTPServer.__init__(self, address, RenderHandler)
+        script.setup_renderer(opts, [root])
+        self.root = os.path.abspath(root)
+        self.extensions = tuple(opts.ext or default_extensions)
+        self.header, self.footer = script.find_customizations(root)
+        shared = script.build_inputs(opts, [root])
+        self.inputs = text_hash(repr(sorted(shared.items())) + self.header + self.footer)
+        self.pages = LRUCache(opts.serve_cache)
+        self.stats = Stats()
+
+    def find_source(self, url_path):
+        """Return the markdown file under root for a request path, if any."""
+        path = os.path.normpath(os.path.join(self.root, url_path.lstrip("/")))
+        if not path.startswith(self.root + os.sep):
+            return None
+        base = path.rsplit(".", 1)[0] if path.endswith(".html") else path
+        for candidate in [path] + [base + ext for ext in self.extensions]:
+            if candidate.endswith(self.extensions) and os.path.isfile(candidate):
+                return candidate
+        return None
+
+def serve(opts, args):
+    server = RenderServer((opts.host, opts.port), opts, args[0])
+    print "Serving %s on http://%s:%d/, press ^C to stop" % (server.root, opts.host, opts.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
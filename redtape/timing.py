@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Per-phase timing of document rendering, for ``rt --profile``.
+
+While a document renders, the phases of the pipeline time themselves into
+the Timings for it in ``current``, and count what they handle, like blocks
+found and bytes in and out.  Phases don't nest, so a document's phase times
+add up to no more than its total.  When nothing is being profiled,
+``current`` is None, and timing a phase costs a function call and a check."""
+
+import json
+import time
+from contextlib import contextmanager
+
+# the Timings of the document being rendered, if it's being profiled
+current = None
+
+class Timings(object):
+    """The time spent in each phase of rendering one document, and counts of
+    what the phases handled."""
+    def __init__(self):
+        self.phases = {}
+        self.counts = {}
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def report(self):
+        return {"phases": dict(self.phases), "counts": dict(self.counts)}
+
+@contextmanager
+def phase(name):
+    """Time the body of this context as the phase name."""
+    timings = current
+    if timings is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings.add(name, time.time() - start)
+
+def count(name, n=1):
+    if current is not None:
+        current.count(name, n)
+
+def timed(chunks, name):
+    """Time getting each item of the iterable chunks as the phase name, for
+    lazy work like rendering a template."""
+    if current is None:
+        return chunks
+    def timed_chunks(timings=current):
+        iterator = iter(chunks)
+        while True:
+            start = time.time()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                timings.add(name, time.time() - start)
+                return
+            timings.add(name, time.time() - start)
+            yield chunk
+    return timed_chunks()
+
+def start():
+    """Start timing a new document."""
+    global current
+    current = Timings()
+    return current
+
+def stop():
+    """Stop timing, returning the document's Timings."""
+    global current
+    timings, current = current, None
+    return timings
+
+def aggregate(documents):
+    """Total up the reports of documents, dicts with a total and the phases
+    and counts from Timings.report."""
+    phases, counts = {}, {}
+    for doc in documents:
+        for name, seconds in doc["phases"].iteritems():
+            phases[name] = phases.get(name, 0.0) + seconds
+        for name, n in doc["counts"].iteritems():
+            counts[name] = counts.get(name, 0) + n
+    return {
+        "documents": len(documents),
+        "total": sum(doc["total"] for doc in documents),
+        "phases": phases,
+        "counts": counts,
+    }
+
+def write_report(path, documents, wall):
+    """Write the json report for a build taking wall seconds to path."""
+    with open(path, "w") as f:
+        json.dump({"wall": wall, "aggregate": aggregate(documents), "documents": documents},
+            f, indent=1, sort_keys=True)
+
+def summary(documents, top=10):
+    """A summary of where the time went: the total for each phase, and the
+    top slowest documents with their slowest phases."""
+    total = aggregate(documents)
+    lines = ["Profiled %d documents, %.3fs in total:" % (total["documents"], total["total"])]
+    for name, seconds in sorted(total["phases"].items(), key=lambda item: -item[1]):
+        share = seconds / total["total"] * 100 if total["total"] else 0
+        lines.append("  %-16s %9.3fs %5.1f%%" % (name, seconds, share))
+    if documents:
+        lines.append("Slowest documents:")
+    for doc in sorted(documents, key=lambda doc: -doc["total"])[:top]:
+        slowest = sorted(doc["phases"].items(), key=lambda item: -item[1])[:3]
+        lines.append("  %8.3fs  %s (%s)" % (doc["total"], doc["path"],
+            ", ".join("%s %.3fs" % item for item in slowest)))
+    return "\n".join(lines)
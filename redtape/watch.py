@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Watch mode for rt, which stays resident and re-renders documents when
+they or the files they depend on change.
+
+The template, markdown and pygments state stay loaded between renders, and
+the argument paths are polled for changes rather than rebuilt from scratch.
+A change to a document re-renders just that document, and a change to a
+template, header.html or footer.html re-renders the documents using it."""
+
+import os
+import time
+
+from redtape import script
+from redtape.publish import gzip_file
+from redtape.search import SearchIndex
+
+def mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def dependencies(opts, args, manifest=None):
+    """Map each document found in args to the argument it was found in and
+    the files it depends on, besides itself: the templates, the header and
+    footer in its directory, and the images it inlined when it was last
+    built, according to manifest."""
+    templates = script.template_files(opts, args)
+    deps = {}
+    for arg in args:
+        custom = []
+        if os.path.isdir(arg):
+            custom = [os.path.join(arg, "header.html"), os.path.join(arg, "footer.html")]
+        for path in script.arg_to_paths(arg, opts.recursive, opts.ext, opts.exclude):
+            images = []
+            if manifest is not None and opts.embed and opts.inline_images:
+                output = script.output_path(path, arg, opts.destination)
+                images = sorted(manifest.outputs.get(output, {}).get("images") or ())
+            deps[path] = (arg, custom + templates + images)
+    return deps
+
+def all_files(deps):
+    files = set(deps)
+    for arg, paths in deps.itervalues():
+        files.update(paths)
+    return files
+
+def snapshot(deps):
+    """The mtime of every file in deps."""
+    return dict((path, mtime(path)) for path in all_files(deps))
+
+def stale_documents(deps, changed):
+    """The documents in deps to re-render when the files in changed have
+    changed: those which changed themselves, or one of whose dependencies
+    did."""
+    return [path for path in sorted(deps)
+        if path in changed or changed.intersection(deps[path][1])]
+
+def watch(opts, args, manifest):
+    """Poll for changes every opts.interval seconds until interrupted,
+    re-rendering the documents that changed and updating the manifest."""
+    print "Watching for changes, press ^C to stop"
+    script.setup_renderer(opts, args)
+    deps = dependencies(opts, args, manifest)
+    seen = snapshot(deps)
+    try:
+        while True:
+            time.sleep(opts.interval)
+            deps = dependencies(opts, args, manifest)
+            current = snapshot(deps)
+            changed = set(path for path in current if current[path] != seen.get(path))
+            seen = current
+            if not changed:
+                continue
+            if changed.intersection(script.template_files(opts, args)):
+                script.setup_renderer(opts, args)
+            shared = script.build_inputs(opts, args)
+            for path in stale_documents(deps, changed):
+                arg = deps[path][0]
+                header, footer = "", ""
+                if os.path.isdir(arg):
+                    header, footer = script.find_customizations(arg)
+                try:
+                    output = script.output_path(path, arg, opts.destination)
+                    job, inputs = script.document_job(path, header, footer, shared, output)
+                except IOError, e:
+                    print "Error reading %s: %s" % (path, e)
+                    continue
+                if opts.embed and opts.inline_images:
+                    inputs["images"] = manifest.dependencies(job[1], "images")
+                if manifest.is_fresh(job[1], inputs):
+                    continue
+                created, messages, hits, misses, images, counts, profile = script.render_document(job)
+                for message in messages:
+                    print message
+                if created:
+                    if opts.embed and opts.inline_images:
+                        inputs["images"] = images
+                    manifest.update(job[1], inputs)
+                    if opts.gzip and (messages[-1].startswith("Created")
+                            or not os.path.exists(job[1] + ".gz")):
+                        gzip_file(job[1])
+            if opts.search:
+                documents = [(path, script.output_path(path, deps[path][0], opts.destination))
+                    for path in sorted(deps)]
+                for path in SearchIndex(opts.destination or os.curdir).update(documents):
+                    if opts.gzip:
+                        gzip_file(path)
+            manifest.save()
+    except KeyboardInterrupt:
+        manifest.save()
+    return 0
@@ -39,7 +39,7 @@ setup(
     scripts=['bin/rt'],
     #package_data={'redtape': ['assets/*']},
     install_requires=[
-        "markdown",
+        "markdown>=3.0",
         "pygments",
         "jinja2",
       # -*- Extra requirements: -*-
@@ -3,8 +3,19 @@
 
 """redtape tests."""
 
+from __future__ import absolute_import
+
+import os
+import time
+import shutil
+import tempfile
 from unittest import TestCase
 
+from redtape import gfm, lexers, script
+from redtape.cache import HighlightCache
+from redtape.discovery import walk
+from redtape.manifest import Manifest, text_hash
+
 class redtapeTest(TestCase):
     def setUp(self):
         pass
@@ -12,3 +23,511 @@ class redtapeTest(TestCase):
     def tearDown(self):
         pass
 
+    def test_size_budget(self):
+        opts, args = script.parser.parse_args(["--max-size", "10"])
+        self.assertTrue(script.render_markdown(u"# short", opts))
+        self.assertRaises(script.BudgetExceeded, script.render_markdown, u"# too long for it", opts)
+
+    def test_time_budget(self):
+        def spin():
+            with script.time_budget(0.05):
+                while True:
+                    time.sleep(0.01)
+        self.assertRaises(script.BudgetExceeded, spin)
+
+class cacheTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_highlight_cache(self):
+        cache = HighlightCache(self.path)
+        block = u"```python\nprint 'hi'\n```"
+        html = gfm.fenced_pygments(block, cache)
+        self.assertEqual(gfm.fenced_pygments(block, cache), html)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(gfm.fenced_pygments(block, HighlightCache(self.path)), html)
+
+    def test_eviction(self):
+        cache = HighlightCache(self.path, max_size=100)
+        for i in range(10):
+            cache.set(cache.key(i), u"x" * 20)
+            if os.path.exists(cache.entry_path(cache.key(i))):
+                os.utime(cache.entry_path(cache.key(i)), (i, i))
+        self.assertTrue(cache.total <= 100)
+        self.assertEqual(cache.get(cache.key(9)), u"x" * 20)
+        self.assertEqual(cache.get(cache.key(0)), None)
+
+class lexersTest(TestCase):
+    def tearDown(self):
+        lexers.default_language = None
+
+    def test_lexer_for_name(self):
+        self.assertTrue(lexers.lexer_for_name("Python") is lexers.lexer_for_name("python"))
+        self.assertTrue(lexers.lexer_for_name("py") is lexers.lexer_for_name("python"))
+        self.assertEqual(lexers.lexer_for_name("no-such-language"), None)
+
+    def test_sniffing(self):
+        self.assertEqual(lexers.sniff_language("#!/usr/bin/env python\nprint 1"), "python")
+        self.assertEqual(lexers.sniff_language("#!/bin/sh\nls"), "bash")
+        self.assertEqual(lexers.sniff_language("<?php echo 1; ?>"), "php")
+        self.assertEqual(lexers.sniff_language("x = 1"), None)
+
+    def test_default_language(self):
+        lexers.default_language = "ruby"
+        self.assertEqual(lexers.get_lexer(None, "x = 1").name, "Ruby")
+        self.assertEqual(lexers.get_lexer("nosuchlang", "x = 1").name, "Ruby")
+        self.assertEqual(lexers.get_lexer("python", "x = 1").name, "Python")
+
+class gfmTest(TestCase):
+    def test_parallel_highlighting(self):
+        from multiprocessing import Pool
+        text = u"\n\n".join(u"```%s\nx = %d\n```\n\n`y_%d`" % (lang, i, i)
+                for i, lang in enumerate(["python", "ruby", "", "c"] * 5))
+        pool = Pool(2)
+        try:
+            self.assertEqual(gfm.gfm(text, "pygments", pool=pool), gfm.gfm(text, "pygments"))
+        finally:
+            pool.close()
+
+    def test_reference(self):
+        from redtape import reference
+        texts = [
+            u"foo_bar_baz `a_b_c` http://example.com/a_b_c\nnext line\n\n    x_y_z",
+            u"<pre>\n`foo_bar_baz\n</pre> ```python\nx = 1\n``` `q` naïve_a_b",
+            u"```\nunclosed `a_b_c` <pre> d_e_f",
+        ]
+        for text in texts:
+            for fenced in ("bootstrap", "pygments", None):
+                self.assertEqual(gfm.gfm(text, fenced), reference.gfm(text, fenced))
+            self.assertEqual(gfm.gfmd(text), reference.gfmd(text))
+
+class manifestTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_manifest(self):
+        path = os.path.join(self.path, "manifest")
+        output = os.path.join(self.path, "doc.html")
+        inputs = {"source": text_hash(u"# doc")}
+        manifest = Manifest(path)
+        manifest.update(output, inputs)
+        manifest.save()
+        self.assertFalse(Manifest(path).is_fresh(output, inputs))
+        open(output, "w").close()
+        self.assertTrue(Manifest(path).is_fresh(output, inputs))
+        self.assertFalse(Manifest(path).is_fresh(output, {"source": text_hash(u"# new")}))
+
+class renderTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        opts, args = script.parser.parse_args(["--no-cache", self.path])
+        script.setup_renderer(opts, args)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_render_document(self):
+        output = os.path.join(self.path, "doc.html")
+        created, messages, hits, misses, images, counts, profile = script.render_document(
+            ("doc.md", output, "# Title\n\nbody", "", ""))
+        self.assertTrue(created)
+        self.assertTrue("<title>Title</title>" in open(output).read())
+        output = os.path.join(self.path, "out", "doc.html")
+        self.assertTrue(script.render_document(("doc.md", output, "body", "", ""))[0])
+        self.assertTrue(os.path.isfile(output))
+
+    def test_document_job(self):
+        path, output = os.path.join(self.path, "doc.md"), os.path.join(self.path, "doc.html")
+        with open(path, "w") as f:
+            f.write("# Title\n\nbody")
+        job, inputs = script.document_job(path, "", "", {}, output)
+        self.assertEqual(job[2], None)
+        self.assertEqual(inputs["source"], text_hash("# Title\n\nbody"))
+        self.assertTrue(script.render_document(job)[0])
+        self.assertTrue("<title>Title</title>" in open(output).read())
+
+    def test_render_document_errors(self):
+        output = os.path.join(self.path, "doc.html")
+        created, messages, hits, misses, images, counts, profile = script.render_document(
+            ("doc.md", output, "# Title \xff", "", ""))
+        self.assertFalse(created)
+        self.assertTrue(messages[-1].startswith("Error rendering doc.md"))
+
+    def test_setup_worker_errors(self):
+        template = os.path.join(self.path, "bad.jinja")
+        with open(template, "w") as f:
+            f.write("{% block x %}")
+        opts, args = script.parser.parse_args(["--no-cache", "-t", template, self.path])
+        self.assertRaises(Exception, script.setup_renderer, opts, args)
+        script.setup_worker(opts, args)
+        created, messages = script.render_document(("doc.md", "doc.html", "body", "", ""))[:2]
+        self.assertFalse(created)
+        self.assertTrue(messages[0].startswith("Error rendering doc.md: "))
+        self.assertFalse(os.path.exists("doc.html"))
+
+    def test_render_document_images(self):
+        opts, args = script.parser.parse_args(["--no-cache", "--embed",
+            "--inline-images", "8", self.path])
+        script.setup_renderer(opts, args)
+        for name, content in (("a.png", "png"), ("b.gif", "png"), ("big.png", "x" * 9)):
+            with open(os.path.join(self.path, name), "wb") as f:
+                f.write(content)
+        path, output = os.path.join(self.path, "doc.md"), os.path.join(self.path, "doc.html")
+        source = "![a](a.png) ![a](a.png?x) ![b](b.gif) ![c](big.png) ![d](http://x/d.png)"
+        created, messages, hits, misses, images, counts, profile = script.render_document(
+            (path, output, source, "", ""))
+        page = open(output).read()
+        self.assertEqual(page.count('src="data:image/png;base64,cG5n"'), 2)
+        self.assertTrue('src="data:image/gif;base64,cG5n"' in page)
+        self.assertTrue('src="big.png"' in page and 'src="http://x/d.png"' in page)
+        self.assertEqual(images, {os.path.join(self.path, "a.png"): text_hash("png"),
+            os.path.join(self.path, "b.gif"): text_hash("png")})
+        self.assertEqual(counts, [3, 9, 2, 6, 1, 9])
+
+class timingTest(TestCase):
+    def test_render_document_profile(self):
+        from redtape import timing
+        path = tempfile.mkdtemp()
+        try:
+            opts, args = script.parser.parse_args(["--no-cache", "--profile", path])
+            script.setup_renderer(opts, args)
+            output = os.path.join(path, "doc.html")
+            source = "# Title\n\n```python\nx = 1\n```\n\n`a` and <pre>b</pre>\n"
+            result = script.render_document(("doc.md", output, source, "", ""))
+        finally:
+            shutil.rmtree(path)
+        profile = result[-1]
+        self.assertTrue(set(["remove_blocks", "highlight", "transform", "markdown",
+            "template", "write"]) <= set(profile["phases"]))
+        self.assertTrue(sum(profile["phases"].values()) <= profile["total"])
+        self.assertEqual(profile["counts"]["fenced blocks"], 1)
+        self.assertEqual(profile["counts"]["bytes in"], len(source))
+        self.assertTrue(timing.current is None)
+        summary = timing.summary([profile, dict(profile, path="slow.md", total=9.0)], 1)
+        self.assertTrue("slow.md" in summary and "doc.md" not in summary)
+
+class searchTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.state = os.path.join(self.path, "state")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name, body):
+        path = os.path.join(self.path, name)
+        with open(path, "w") as f:
+            f.write("<html><head><title>%s</title><style>h1 { x: 1 }</style></head>\n"
+                "<body><p>Banner</p>\n<!-- rt:document -->%s\n<script>var hidden;</script>"
+                "<!-- /rt:document --><p>Footer</p></body></html>\n" % (name, body))
+        return path, path
+
+    def shard(self, name):
+        import json
+        with open(os.path.join(self.path, "search", name + ".json")) as f:
+            return json.load(f)
+
+    def test_index(self):
+        from redtape.search import SearchIndex, shard_name
+        a = self.write("a.html", '<p>Widgets <a\nhref="x">here</a></p>\n<h2 id="use">Use &amp; caf\xc3\xa9</h2>\n<p>widgets 42</p>')
+        b = self.write("b.html", "<p>gadgets</p>")
+        index = SearchIndex(self.path, self.state)
+        index.update([a, b])
+        self.assertEqual(index.docs[0]["headings"], [["use", u"Use & caf\xe9"]])
+        self.assertEqual(self.shard("wi"), {"widgets": [0, -1, 0, 0]})
+        self.assertEqual(self.shard("he"), {"here": [0, -1]})
+        self.assertEqual(self.shard(shard_name(u"caf\xe9")), {u"caf\xe9": [0, 0]})
+        self.assertFalse(os.path.exists(os.path.join(self.path, "search", "hi.json")))
+        self.assertFalse(os.path.exists(os.path.join(self.path, "search", "ba.json")))
+        self.assertFalse(os.path.exists(os.path.join(self.path, "search", "fo.json")))
+
+        index = SearchIndex(self.path, self.state)
+        self.assertEqual(index.update([a, b]), [])
+        self.write("a.html", "<p>gadgets</p>")
+        os.remove(b[1])
+        index = SearchIndex(self.path, self.state)
+        index.update([a, b])
+        self.assertEqual((index.reindexed, index.removed), (1, 1))
+        self.assertEqual(self.shard("ga"), {"gadgets": [0, -1]})
+        self.assertFalse(os.path.exists(os.path.join(self.path, "search", "wi.json")))
+
+    def test_rendered_page(self):
+        from redtape.renderer import Renderer
+        from redtape.search import index_page
+        renderer = Renderer(fenced="bootstrap", header="<p>Banner</p>", footer="<p>Footer</p>",
+            mark_document=True)
+        path = os.path.join(self.path, "page.html")
+        with open(path, "w") as f:
+            f.write(renderer.render(u"# Title\n\nwidgets").encode("utf-8"))
+        title, headings, postings = index_page(path)
+        self.assertEqual((title, headings), (u"Title", [["title", u"Title"]]))
+        self.assertEqual(sorted(postings), [u"title", u"widgets"])
+
+    def test_destinations(self):
+        import json
+        from redtape.search import SearchIndex
+        pages = [self.write("a.html", "<p>widgets</p>"), self.write("b.html", "<p>gadgets</p>")]
+        first, second = os.path.join(self.path, "first"), os.path.join(self.path, "second")
+        for directory in (first, second, first):
+            index = SearchIndex(directory)
+            index.update(pages)
+        self.assertEqual(index.reindexed, 0)
+        with open(os.path.join(first, "search", "docs.json")) as f:
+            self.assertEqual(len(json.load(f)), 2)
+        self.assertTrue(os.path.isfile(os.path.join(second, "search", ".state.json")))
+
+class serverTest(TestCase):
+    def test_lru_cache(self):
+        from redtape.server import LRUCache
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_render_server(self):
+        import json
+        import httplib
+        import threading
+        from redtape.server import RenderHandler, RenderServer
+        path = tempfile.mkdtemp()
+        with open(os.path.join(path, "doc.md"), "w") as f:
+            f.write("# Served\n")
+        opts, args = script.parser.parse_args(["--no-cache", path])
+        server = RenderServer(("127.0.0.1", 0), opts, path)
+        class QuietHandler(RenderHandler):
+            def log_message(self, *args):
+                pass
+        server.RequestHandlerClass = QuietHandler
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        def get(url, headers={}):
+            connection = httplib.HTTPConnection("127.0.0.1", server.server_address[1])
+            connection.request("GET", url, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.getheader("ETag"), response.read()
+        try:
+            status, etag, page = get("/doc.html")
+            self.assertEqual(status, 200)
+            self.assertTrue("<title>Served</title>" in page)
+            self.assertEqual(get("/doc.html", {"If-None-Match": etag})[:2], (304, etag))
+            self.assertEqual(get("/doc.html")[2], page)
+            self.assertEqual(get("/missing.html")[0], 404)
+            stats = json.loads(get("/_stats")[2])
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+            shutil.rmtree(path)
+        self.assertEqual((stats["requests"], stats["renders"], stats["not_modified"]), (4, 1, 1))
+        self.assertEqual((stats["cache"]["hits"], stats["cache"]["misses"]), (1, 1))
+
+class watchTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def touch(self, *names):
+        path = os.path.join(self.path, *names)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "a") as f:
+            f.write("\n")
+        os.utime(path, (1, time.time() + 10))
+        return path
+
+    def test_stale_documents(self):
+        from redtape import watch
+        first, second = os.path.join(self.path, "first"), os.path.join(self.path, "second")
+        a, b = self.touch("first", "a.md"), self.touch("first", "sub", "b.md")
+        c = self.touch("second", "c.md")
+        header, template = self.touch("first", "header.html"), self.touch("custom.jinja")
+        opts, args = script.parser.parse_args(["-r", "-t", template, first, second])
+        deps = watch.dependencies(opts, args)
+        self.assertEqual(sorted(deps), [a, b, c])
+        seen = watch.snapshot(deps)
+        for changed, stale in ((a, [a]), (header, [a, b]), (template, [a, b, c])):
+            os.utime(changed, (1, seen[changed] + 20))
+            current = watch.snapshot(deps)
+            changes = set(path for path in current if current[path] != seen[path])
+            self.assertEqual(watch.stale_documents(deps, changes), stale)
+            seen = current
+
+class discoveryTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for path in ("a.md", "b.txt", ".hidden.md", "docs/c.md", "docs/old/d.md",
+                "node_modules/pkg/e.md", "drafts/f.md", "sub/drafts/g.md"):
+            path = os.path.join(self.root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def found(self, *args, **kwargs):
+        return [os.path.relpath(p, self.root) for p in walk(self.root, *args, **kwargs)]
+
+    def test_walk(self):
+        self.assertEqual(self.found(False), ["a.md"])
+        self.assertEqual(self.found(), ["a.md", "docs/c.md", "docs/old/d.md",
+            "drafts/f.md", "sub/drafts/g.md"])
+        self.assertEqual(self.found(extensions=[".txt"]), ["b.txt"])
+
+    def test_excludes(self):
+        self.assertEqual(self.found(excludes=["/drafts", "docs/**/old"]),
+            ["a.md", "docs/c.md", "sub/drafts/g.md"])
+        self.assertEqual(self.found(excludes=["drafts/", "*.md", "!c.md"]), ["docs/c.md"])
+        self.assertTrue("node_modules/pkg/e.md" in self.found(excludes=["!node_modules"]))
+
+    def test_output_path(self):
+        self.assertEqual(script.output_path("src/docs/a.md", "src"), "src/docs/a.html")
+        self.assertEqual(script.output_path("src/docs/a.md", "src/docs/a.md", "out"), "out/a.html")
+        self.assertEqual(script.output_path(os.path.join(self.root, "docs/c.md"),
+            self.root, "out"), "out/docs/c.html")
+
+class publishTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_fingerprint_assets(self):
+        from redtape.publish import fingerprint_assets, publish_assets
+        published = fingerprint_assets(["assets/css/bootstrap.min.css"])
+        self.assertEqual(len(published), 3)
+        name, content = published["assets/css/bootstrap.min.css"]
+        image = published["assets/img/glyphicons-halflings.png"][0]
+        self.assertTrue(name.startswith("assets/css/bootstrap.min.") and name.endswith(".css"))
+        self.assertTrue('url("../img/%s")' % os.path.basename(image) in content)
+        paths = publish_assets(published, self.path)
+        self.assertTrue(os.path.join(self.path, "assets", "img", os.path.basename(image)) in paths)
+        self.assertEqual(open(os.path.join(self.path, name)).read(), content)
+
+    def test_fingerprinted_links(self):
+        destination = os.path.join(self.path, "site")
+        opts, args = script.parser.parse_args(["--no-cache", "--fingerprint", "-o", destination, self.path])
+        script.setup_renderer(opts, args)
+        for output, prefix in (("a.html", "assets/"), ("sub/deeper/b.html", "../../assets/")):
+            output = os.path.join(destination, output)
+            self.assertTrue(script.render_document(("doc.md", output, "# doc", "", ""))[0])
+            self.assertTrue('href="%scss/bootstrap.min.' % prefix in open(output).read())
+
+    def test_gzip_files(self):
+        import gzip
+        from redtape.publish import gzip_files
+        paths = [os.path.join(self.path, name) for name in ("a.html", "b.html")]
+        for path in paths:
+            open(path, "w").write("<p>hello</p>" * 100)
+        gzip_files(paths)
+        first = open(paths[0] + ".gz").read()
+        self.assertEqual(first, open(paths[1] + ".gz").read())
+        self.assertEqual(gzip.open(paths[0] + ".gz").read(), "<p>hello</p>" * 100)
+
+class embedTest(TestCase):
+    def test_shake_css(self):
+        from redtape.embed import parse_css, shake_css
+        items = parse_css('/*! keep */ a:hover,.x b{color:red} .y{content:"}"} '
+            '@media (max-width:9px){.x{margin:0}.z{margin:1px}} @charset "utf-8";')
+        self.assertEqual(shake_css(items, set(["a", ".x"])),
+            '/*! keep */\na:hover{color:red}\n@media (max-width:9px){.x{margin:0}}\n@charset "utf-8";')
+
+    def test_shaken_page(self):
+        from redtape.renderer import Renderer
+        text = u"# T\n\n```lisp\n(f)\n```\n"
+        page = Renderer(fenced="bootstrap", embed=True, shake=True).render(text)
+        full = Renderer(fenced="bootstrap", embed=True).render(text)
+        self.assertTrue(len(page) < len(full) / 2)
+        self.assertTrue(u".container{" in page and u".navbar" not in page)
+        self.assertTrue(u'"cl","el","lisp","scm"' in page)
+        self.assertTrue(u'<pre class="prettyprint linenums lang-lisp">' in page)
+
+    def test_language_packs(self):
+        from redtape.embed import Shaker, language_packs
+        from redtape.renderer import Renderer
+        shaker = Shaker([], ["assets/js/prettify.js"])
+        packs = language_packs()
+        self.assertTrue("go" in packs and "sql" in packs)
+        for asset in set(packs.values()):
+            self.assertTrue(u"PR.registerLangHandler" in shaker.content(asset))
+        page = Renderer(fenced="bootstrap", embed=True, shake=True).render(u"```go\npackage main\n```\n")
+        self.assertTrue(u'"go"' in page)
+
+class rendererTest(TestCase):
+    def test_render(self):
+        from redtape.renderer import Renderer
+        renderer = Renderer(fenced="bootstrap", header="<p>head</p>")
+        page = renderer.render(u"# Title\n\nfoo_bar_baz")
+        self.assertTrue(u"<title>Title</title>" in page)
+        self.assertTrue(u"<p>head</p>" in page)
+        self.assertEqual(renderer.convert(u"foo_bar_baz"), gfm.gfmd(u"foo_bar_baz"))
+
+    def test_render_many(self):
+        from redtape.renderer import Renderer
+        renderer = Renderer(fenced="bootstrap")
+        texts = [u"# One\n\n[a]: http://a", u"# Two\n\n[a]"]
+        pages = list(renderer.render_many(texts))
+        self.assertEqual(pages, [renderer.render(text) for text in texts])
+        self.assertFalse(u'href="http://a"' in pages[1])
+
+    def test_outline(self):
+        from redtape.renderer import Renderer
+        renderer = Renderer(fenced="bootstrap")
+        html = renderer.convert(u"# A Title\n\n## Part\n\n## Part\n\nfoo")
+        self.assertEqual(renderer.title, u"A Title")
+        self.assertEqual([h["id"] for h in renderer.outline], ["a-title", "part", "part-2"])
+        self.assertTrue(u'<h2 id="part-2">Part</h2>' in html)
+        renderer.convert(u"no headings")
+        self.assertEqual((renderer.title, renderer.outline), (u"", []))
+
+    def test_convert_chunks(self):
+        from redtape.renderer import Renderer
+        renderer = Renderer(fenced="bootstrap")
+        text = (u"# Part\n\nsee [a]\n\n<div>\n\nraw\n</div>\n\n    code\n\n"
+            u"[b]: /b\n\n    more\n\n## Part\n\n[a]: /a\n")
+        html = renderer.convert(text)
+        title, outline = renderer.title, renderer.outline
+        chunks = list(gfm.split_blocks(text.splitlines(True), 0))
+        self.assertTrue(len(chunks) > 3)
+        self.assertEqual(u"".join(renderer.convert_chunks(chunks)), html)
+        self.assertEqual((renderer.title, renderer.outline), (title, outline))
+        self.assertTrue(u'<a href="/a">a</a>' in html)
+        # a fence's code is raw html to markdown when it isn't highlighted
+        text = u"# Title\n\n```python\n<pre>\n```\n\n## Part\n\n<div><div>\n\nlast\n"
+        html = renderer.convert(text)
+        outline = renderer.outline
+        chunks = list(gfm.split_blocks(text.splitlines(True), 0))
+        self.assertEqual(u"".join(renderer.convert_chunks(chunks)), html)
+        self.assertEqual(renderer.outline, outline)
+
+    def test_write_stream(self):
+        path = tempfile.mktemp()
+        try:
+            self.assertTrue(script.write_stream([u"caf", u"\xe9 " * 70000, u""], path, buffer_size=1000))
+            self.assertEqual(open(path).read().decode("utf-8"), u"caf" + u"\xe9 " * 70000)
+            os.utime(path, (0, 0))
+            self.assertFalse(script.write_stream([u"caf\xe9 ", u"\xe9 " * 69999], path))
+            self.assertEqual(os.path.getmtime(path), 0)
+            self.assertTrue(script.write_stream([u"caf\xe9"], path))
+            self.assertEqual(open(path).read(), "caf\xc3\xa9")
+            def failing():
+                yield u"partial"
+                raise ValueError("render failed")
+            self.assertRaises(ValueError, lambda: script.write_stream(failing(), path))
+            self.assertEqual(open(path).read(), "caf\xc3\xa9")
+            self.assertEqual(os.listdir(os.path.dirname(path)).count(os.path.basename(path) + ".%d.tmp" % os.getpid()), 0)
+        finally:
+            os.remove(path)